@@ -0,0 +1,86 @@
+import os
+import platform
+import resource
+import subprocess
+import sys
+from time import perf_counter
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEVICE_DIR = os.path.join(REPO, 'tensor-flow', 'package')
+SERVER_DIR = os.path.join(REPO, 'opencv')
+
+
+def percentile(sorted_values, p):
+    """Nearest rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, total_seconds, items_per_call=1):
+    """latencies:(list) seconds per call -> (dict) throughput and latency figures"""
+    ordered = sorted(latencies)
+    n = len(ordered)
+    return {
+        'n': n * items_per_call,
+        'fps': round(n * items_per_call / total_seconds, 2) if total_seconds else None,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3) if n else None,
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3) if n else None,
+        'mean_ms': round(sum(ordered) / n * 1000, 3) if n else None,
+        'max_ms': round(ordered[-1] * 1000, 3) if n else None,
+    }
+
+
+def measure(fn, inputs, warm_up=3, items_per_call=1):
+    """Calls fn on every input after warm_up untimed calls -> summarize() of the timed ones"""
+    for item in inputs[:warm_up]:
+        fn(item)
+    latencies = []
+    started = perf_counter()
+    for item in inputs:
+        call_started = perf_counter()
+        fn(item)
+        latencies.append(perf_counter() - call_started)
+    return summarize(latencies, perf_counter() - started, items_per_call)
+
+
+def count_error(predicted, truth):
+    """Per frame counts against golden counts -> (dict) MAE, bias and exact match ratio"""
+    pairs = [(p, t) for p, t in zip(predicted, truth) if t is not None]
+    if not pairs:
+        return None
+    errors = [p - t for p, t in pairs]
+    return {
+        'frames': len(pairs),
+        'mae': round(sum(abs(e) for e in errors) / len(errors), 4),
+        'bias': round(sum(errors) / len(errors), 4),
+        'exact': round(sum(1 for e in errors if e == 0) / len(errors), 4),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def skipped(err):
+    return {'skipped': f"{type(err).__name__}: {err}"}
+
+
+def environment():
+    """-> (dict) what the numbers were measured on"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, capture_output=True,
+                                  text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
@@ -0,0 +1,64 @@
+"""
+Compares two benchmark result files and flags regressions.
+
+    python benchmarks/compare.py baseline.json candidate.json --tolerance 0.1
+
+Latencies (p50/p99) that grow and throughputs (fps) that shrink by more
+than the tolerance count as regressions, as does a higher count error MAE.
+Exits with status 1 when there is any.
+"""
+import argparse
+import json
+
+# Metric name -> whether bigger is better
+METRICS = {'fps': True, 'p50_ms': False, 'p99_ms': False, 'mae': False, 'peak_rss_mb': False}
+
+
+def flatten(result, prefix=''):
+    """Nested result dict -> {dotted.path: number} of the compared metrics"""
+    flat = {}
+    for key, value in result.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif key in METRICS and isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline, candidate, tolerance):
+    """-> (list) (path, before, after, change, regressed) for metrics present in both"""
+    before = flatten(baseline['results'])
+    after = flatten(candidate['results'])
+    rows = []
+    for path in sorted(before.keys() & after.keys()):
+        old, new = before[path], after[path]
+        change = (new - old) / old if old else 0.0
+        bigger_is_better = METRICS[path.rsplit('.', 1)[-1]]
+        regressed = -change > tolerance if bigger_is_better else change > tolerance
+        rows.append((path, old, new, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative change allowed before flagging')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    rows = compare(baseline, candidate, args.tolerance)
+    print(f"{baseline['environment'].get('revision')} -> {candidate['environment'].get('revision')}")
+    for path, old, new, change, regressed in rows:
+        print(f"{'!!' if regressed else '  '} {path:<55}{old:>12g}{new:>12g}{change:>+9.1%}")
+    regressions = sum(1 for row in rows if row[-1])
+    print(f"{regressions} regression(s) beyond {args.tolerance:.0%}")
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Device side benchmarks: tflite and OpenCV inference, post-processing,
+aggregation and the threaded pipeline, run on recorded or synthetic frames
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from common import DEVICE_DIR, SERVER_DIR, count_error, measure, peak_rss_mb, skipped
+
+# data.py reads these when a Data is made, the pipeline benchmark never uploads
+for name, value in (('POST_DATA_ROUTE', 'http://127.0.0.1:9/add/'), ('USER', 'bench'), ('PASSWORD', 'bench')):
+    os.environ.setdefault(name, value)
+
+
+def load_frames(options, width, height):
+    """
+    -> (frames, truth) from --frames-dir or the synthetic source. truth holds
+    the --golden count of every frame that has one; the synthetic rectangles
+    are nothing a person model detects, so they never carry a count
+    """
+    from sources import JpegDirectorySource, SyntheticSource
+    golden = {}
+    if options.get('golden'):
+        with open(options['golden']) as f:
+            golden = json.load(f)
+    frames, truth = [], []
+    if options.get('frames_dir'):
+        source = JpegDirectorySource(options['frames_dir'], prefetch=0)
+        with source.open(width, height):
+            for frame in source.capture_continuous():
+                if len(frames) >= options['frames']:
+                    break
+                frames.append(frame.copy())
+                truth.append(golden.get(os.path.basename(source.paths[source.index - 1])))
+    else:
+        source = SyntheticSource(frames=options['frames'])
+        with source.open(width, height):
+            for frame in source.capture_continuous():
+                frames.append(frame.copy())
+                truth.append(None)
+    return frames, truth
+
+
+def add_accuracy(result, counts, truth):
+    """Adds count_error against the golden counts, when the recording has them"""
+    error = count_error(counts[-len(truth):], truth)
+    if error is not None:
+        result['count_error'] = error
+    return result
+
+
+def bench_tflite(options):
+    from detector import Detector
+    detector = Detector(options['model'], options['labels'], options['threshold'],
+                        num_threads=options.get('num_threads'))
+    frames, truth = load_frames(options, *detector.capture_size)
+    counts = []
+    result = measure(lambda frame: counts.append(len(detector.detect_objects(frame))), frames)
+    return add_accuracy(result, counts, truth)
+
+
+def bench_opencv(options):
+    """
+    The device's OpenCV backend and the server's Controller/detector.py,
+    both the module level detect() + people_count() that routes use and
+    PersonDetector.count_people batching
+    """
+    from backends import OpenCVBackend
+    backend = OpenCVBackend(threshold=options['threshold'])
+    backend.load()
+    frames, truth = load_frames(options, *backend.capture_size)
+    batch_size = options.get('batch_size', 8)
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames) - batch_size + 1, batch_size)]
+    counts = []
+    result = {'backend': add_accuracy(
+        {'single': measure(lambda frame: counts.append(len(backend.detect([frame])[0])), frames)},
+        counts, truth)}
+    if batches:
+        result['backend']['batched'] = measure(backend.detect, batches, warm_up=1, items_per_call=batch_size)
+
+    sys.path.insert(0, SERVER_DIR)
+    from Controller import detector as server
+    # The server reads BGR images, the sources hand out RGB
+    images = [np.ascontiguousarray(frame[..., ::-1]) for frame in frames]
+    person_detector = server.get_detector()
+    counts = []
+    result['server'] = add_accuracy(
+        {'detect': measure(lambda image: counts.append(server.people_count(person_detector.detect(image))),
+                           images)},
+        counts, truth)
+    if options.get('frames_dir'):
+        # detect() as routes call it, decoding the image file too
+        paths = sorted(os.path.join(options['frames_dir'], name) for name in os.listdir(options['frames_dir'])
+                       if name.lower().endswith(server.IMAGE_EXTENSIONS))[:len(frames)]
+        result['server']['detect_file'] = measure(server.detect, paths)
+    batches = [images[i:i + batch_size] for i in range(0, len(images) - batch_size + 1, batch_size)]
+    if batches:
+        result['server']['count_people'] = measure(person_detector.count_people, batches, warm_up=1,
+                                                   items_per_call=batch_size)
+    return result
+
+
+class _Slot(object):
+    """Interpreter output tensors as Detector._filtered_results reads them"""
+    def __init__(self, n, rng):
+        boxes = np.sort(rng.random((1, n, 4), dtype=np.float32), axis=2)[:, :, [0, 2, 1, 3]]
+        self.boxes = lambda: boxes
+        classes = rng.integers(0, 3, (1, n)).astype(np.float32)
+        self.classes = lambda: classes
+        scores = rng.random((1, n), dtype=np.float32)
+        self.scores = lambda: scores
+        count = np.array([n], dtype=np.float32)
+        self.count = lambda: count
+
+
+def bench_postprocess(options):
+    from boxes import non_max_suppression
+    from detector import Detector, DETECTION_DTYPE
+    from tracker import Tracker
+    rng = np.random.default_rng(0)
+    detector = Detector.__new__(Detector)
+    detector.threshold = options['threshold']
+    slots = [_Slot(10, rng) for _ in range(options['frames'])]
+    result = {'filter': measure(detector._filtered_results, slots)}
+
+    def random_detections(n):
+        detections = np.empty(n, dtype=DETECTION_DTYPE)
+        corners = rng.random((n, 2), dtype=np.float32) * 0.8
+        detections['bounding_box'] = np.hstack([corners, corners + 0.1 + rng.random((n, 2), dtype=np.float32) * 0.1])
+        detections['class_id'] = 0
+        detections['score'] = rng.random(n, dtype=np.float32)
+        return detections
+
+    # Tiled inference merges a few hundred boxes per frame
+    merges = [random_detections(200) for _ in range(options['frames'])]
+    result['nms_200'] = measure(lambda d: non_max_suppression(d['bounding_box'], d['score'], 0.5), merges)
+    tracker = Tracker()
+    result['tracker'] = measure(tracker.update, [random_detections(8) for _ in range(options['frames'])])
+    return result
+
+
+def bench_aggregation(options):
+    from aggregator import Aggregator, STATISTICS
+    counts = list(np.random.default_rng(0).integers(0, 20, options['frames'] * 50))
+    result = {}
+    for statistic in STATISTICS:
+        aggregator = Aggregator(statistic, window=5)
+        result[statistic] = measure(lambda count: aggregator.add(int(count), 0.0), counts)
+    return result
+
+
+def bench_pipeline(options):
+    from detector import Detector
+    from metrics import REGISTRY
+    from pipeline import Pipeline
+    from sources import JpegDirectorySource, SyntheticSource
+    detector = Detector(options['model'], options['labels'], options['threshold'],
+                        num_threads=options.get('num_threads'))
+    if options.get('frames_dir'):
+        source = JpegDirectorySource(options['frames_dir'])
+    else:
+        source = SyntheticSource(frames=options['frames'])
+    samples = []
+    with source.open(*detector.capture_size):
+        pipeline = Pipeline(detector, source, capture_interval=0.0, upload_interval=0.0,
+                            sink=samples.append, lossless=True)
+        # Data prints every sample it aggregates
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = perf_counter()
+            pipeline.start()
+            pipeline.wait()
+            elapsed = perf_counter() - started
+            pipeline.stop()
+    result = {'frames': source.frames_read, 'samples': len(samples),
+              'fps': round(source.frames_read / elapsed, 2), 'stages': {}}
+    for stage, histogram in sorted(REGISTRY.histograms.items()):
+        if histogram.count:
+            result['stages'][stage] = {'n': histogram.count,
+                                       'p50_ms': round(histogram.percentile(50) * 1000, 3),
+                                       'p99_ms': round(histogram.percentile(99) * 1000, 3)}
+    return result
+
+
+BENCHMARKS = {
+    'tflite': bench_tflite,
+    'opencv': bench_opencv,
+    'postprocess': bench_postprocess,
+    'aggregation': bench_aggregation,
+    'pipeline': bench_pipeline,
+}
+
+
+def run(name, options):
+    """Runs one device benchmark in this process -> (dict) its results and peak RSS"""
+    sys.path.insert(0, DEVICE_DIR)
+    os.chdir(DEVICE_DIR)
+    try:
+        result = BENCHMARKS[name](options)
+    except Exception as err:
+        # Boards without a runtime still get the remaining numbers
+        return skipped(err)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
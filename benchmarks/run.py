@@ -0,0 +1,73 @@
+"""
+Runs the benchmark suite and writes the results as JSON.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --only tflite,pipeline --frames-dir ~/footage --golden ~/footage/counts.json
+
+Every benchmark runs in a fresh process so its peak RSS is its own.
+Benchmarks whose runtime (tflite, OpenCV, Flask) is missing are reported as
+skipped. --golden is a JSON object mapping frame file names to the true
+person count, count_error is only reported for frames it covers.
+Compare two result files with compare.py.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import device
+import server
+from common import environment
+
+SUITES = {'device': device, 'server': server}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help='Comma separated benchmarks to run: ' + ', '.join(
+        name for suite in SUITES.values() for name in suite.BENCHMARKS))
+    parser.add_argument('--frames', type=int, default=200, help='Frames per device benchmark')
+    parser.add_argument('--frames-dir', help='Directory of recorded JPEG frames, synthetic frames when not given')
+    parser.add_argument('--golden', help='JSON file of true counts per frame file name')
+    parser.add_argument('--model', default='detect.tflite', help='tflite model, relative to tensor-flow/package')
+    parser.add_argument('--labels', default='coco_labels.txt', help='Labels file, relative to tensor-flow/package')
+    parser.add_argument('--threshold', type=float, default=0.6)
+    parser.add_argument('--num-threads', type=int, default=None)
+    parser.add_argument('--rows', type=int, default=50000, help='Rows seeded into the server database')
+    parser.add_argument('--requests', type=int, default=400, help='Requests per server endpoint')
+    parser.add_argument('--output', default='benchmark-results.json')
+    args = parser.parse_args()
+
+    only = set(args.only.split(',')) if args.only else None
+    options = {key: value for key, value in vars(args).items() if key not in ('only', 'output')}
+    for key in ('frames_dir', 'golden'):
+        if options[key]:
+            options[key] = os.path.abspath(options[key])
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for suite_name, suite in SUITES.items():
+        for name in suite.BENCHMARKS:
+            if only and name not in only:
+                continue
+            print(f"{suite_name}/{name} ...", flush=True)
+            started = time.perf_counter()
+            with context.Pool(1) as pool:
+                result = pool.apply(suite.run, (name, options))
+            result['wall_seconds'] = round(time.perf_counter() - started, 2)
+            results[f"{suite_name}/{name}"] = result
+            print(json.dumps(result, indent=2))
+
+    report = {'environment': environment(), 'options': options,
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Server side benchmarks: the Flask endpoints over a scratch SQLite database,
+called in-process through the Flask test client
+"""
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from common import DEVICE_DIR, SERVER_DIR, measure, peak_rss_mb, skipped
+
+DEVICES = ['bench-%d' % i for i in range(4)]
+
+
+def _app():
+    """Imports the app with its database in a fresh scratch directory"""
+    workdir = tempfile.mkdtemp(prefix='bench-server-')
+    # routes opens Model/photos.db relative to the working directory
+    os.makedirs(os.path.join(workdir, 'Model'))
+    os.chdir(workdir)
+    sys.path.insert(0, SERVER_DIR)
+    from Controller import routes
+    return routes
+
+
+def _seed(routes, rows):
+    """Spreads rows samples over the last week, every device reporting"""
+    now = int(time.time())
+    rng = random.Random(0)
+    per_device = rows // len(DEVICES)
+    for device in DEVICES:
+        samples = [{'seq': seq, 'ts': now - 7 * 86400 + seq * 7 * 86400 // per_device,
+                    'number_ppl': rng.randint(0, 30)} for seq in range(per_device)]
+        for start in range(0, len(samples), 5000):
+            routes.DB.add_batch(device, samples[start:start + 5000])
+    return now
+
+
+def bench_endpoints(options):
+    routes = _app()
+    client = routes.app.test_client()
+    requests = options['requests']
+    now = _seed(routes, options['rows'])
+    rng = random.Random(1)
+    result = {'rows': options['rows']}
+
+    def call(method, path, **kwargs):
+        response = client.open(path, method=method, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status_code}")
+
+    result['add'] = measure(lambda body: call('POST', '/add/', data=body),
+                            [json.dumps({'number_ppl': rng.randint(0, 30), 'device': 'bench-add'})
+                             for _ in range(requests)])
+
+    batch_size = 20
+    seq = [10 ** 9]
+
+    def batch():
+        samples = []
+        for _ in range(batch_size):
+            seq[0] += 1
+            samples.append({'seq': seq[0], 'ts': now, 'number_ppl': rng.randint(0, 30)})
+        return samples
+
+    result['add_batch_json'] = measure(
+        lambda body: call('POST', '/add/batch/', data=body, headers={'Content-Encoding': 'gzip'}),
+        [gzip.compress(json.dumps({'device': 'bench-batch', 'samples': batch()}).encode())
+         for _ in range(requests // 4)], items_per_call=batch_size)
+    sys.path.insert(0, DEVICE_DIR)
+    import wire
+    result['add_batch_binary'] = measure(
+        lambda body: call('POST', '/add/batch/', data=body, headers={'Content-Type': wire.CONTENT_TYPE}),
+        [wire.encode('bench-batch', batch()) for _ in range(requests // 4)], items_per_call=batch_size)
+
+    result['getcurrent'] = measure(lambda path: call('GET', path),
+                                   ['/getcurrent/?n=%d' % rng.choice((5, 50, 500)) for _ in range(requests)])
+    week = now - 7 * 86400
+    result['range_day'] = measure(lambda path: call('GET', path),
+                                  ['/range/?start=%d&end=%d&bucket=3600' % (start, start + 86400)
+                                   for start in (rng.randint(week, now - 86400) for _ in range(requests // 10))])
+    result['rollup_week'] = measure(lambda path: call('GET', path),
+                                    ['/rollup/?start=%d&end=%d&resolution=3600' % (week, now)] * (requests // 10))
+    result['getdb_page'] = measure(lambda path: call('GET', path),
+                                   ['/getdb/?limit=500&after_id=%d' % rng.randint(0, options['rows'])
+                                    for _ in range(requests // 10)])
+    return result
+
+
+BENCHMARKS = {
+    'endpoints': bench_endpoints,
+}
+
+
+def run(name, options):
+    """Runs one server benchmark in this process -> (dict) its results and peak RSS"""
+    try:
+        result = BENCHMARKS[name](options)
+    except Exception as err:
+        return skipped(err)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
@@ -1,4 +1,6 @@
+import os
 import cv2
+import numpy as np
 # cap = cv2.VideoCapture(1)
 # cap.set(3,1280)
 # cap.set(4,720)
@@ -6,26 +8,96 @@ import cv2
 
 thresh = 0.5 # Threshold to detect object
 classNames= ["person"]
+PERSON_CLASS_ID = 1
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Object_Detection_Files')
+configPath = os.path.join(MODEL_DIR, 'ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt')
+weightsPath = os.path.join(MODEL_DIR, 'frozen_inference_graph.pb')
 
 # Uncomment to import list of coconames
 # classFile = './Object_Detection_files/coco.names'
 # with open(classFile,'rt') as f:
 #     classNames = f.read().rstrip('\n').split('\n')
 
-def detect(image):
-    """image: image file -> <numpy.ndarray> integer classIds """
-    img = cv2.imread(image)
 
-    configPath = './Object_Detection_files/ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt'
-    weightsPath = './Object_Detection_files/frozen_inference_graph.pb'
+class PersonDetector:
+    '''
+    Long lived SSD-MobileNetV3 detector. The network is parsed and
+    allocated once, images are then run through it in batched blobs
+    '''
+    def __init__(self, weights=weightsPath, config=configPath, threshold=thresh,
+                 input_size=(640, 320), batch_size=8):
+        self.threshold = threshold
+        self.input_size = input_size
+        self.batch_size = batch_size
+        self.net = cv2.dnn.readNetFromTensorflow(weights, config)
+        self.model = cv2.dnn_DetectionModel(self.net)
+        self.model.setInputSize(*input_size)
+        self.model.setInputScale(1.0/ 127.5)
+        self.model.setInputMean((127.5, 127.5, 127.5))
+        self.model.setInputSwapRB(True)
+
+    @staticmethod
+    def load_images(images):
+        """images: directory, file path or list of paths/arrays -> (list) BGR arrays"""
+        if isinstance(images, str):
+            if os.path.isdir(images):
+                images = sorted(os.path.join(images, name) for name in os.listdir(images)
+                                if name.lower().endswith(IMAGE_EXTENSIONS))
+            else:
+                images = [images]
+        loaded = []
+        for image in images:
+            img = cv2.imread(image) if isinstance(image, str) else image
+            if img is None:
+                raise ValueError("Could not read image: {}".format(image))
+            loaded.append(img)
+        return loaded
+
+    def detect(self, image):
+        """image: image file or array -> <numpy.ndarray> integer classIds"""
+        img = cv2.imread(image) if isinstance(image, str) else image
+        classIds, confs, bbox = self.model.detect(img, confThreshold=self.threshold)
+        return classIds
+
+    def _forward(self, batch):
+        """Runs one batched blob -> <numpy.ndarray> (N, 7) detection rows"""
+        blob = cv2.dnn.blobFromImages(batch, scalefactor=1.0/ 127.5, size=self.input_size,
+                                      mean=(127.5, 127.5, 127.5), swapRB=True, crop=False)
+        self.net.setInput(blob)
+        # Rows are [image_id, class_id, confidence, xmin, ymin, xmax, ymax]
+        return self.net.forward().reshape(-1, 7)
 
-    net = cv2.dnn_DetectionModel(weightsPath,configPath)
-    net.setInputSize(640,320)
-    net.setInputScale(1.0/ 127.5)
-    net.setInputMean((127.5, 127.5, 127.5))
-    net.setInputSwapRB(True)
+    def count_people(self, images):
+        """
+        images: directory, file path or list of paths/arrays
+        -> <numpy.ndarray> person count for every image, in input order
+        """
+        images = self.load_images(images)
+        counts = np.zeros(len(images), dtype=np.int32)
+        for start in range(0, len(images), self.batch_size):
+            batch = images[start:start + self.batch_size]
+            rows = self._forward(batch)
+            hits = rows[(rows[:, 1] == PERSON_CLASS_ID) & (rows[:, 2] >= self.threshold)]
+            counts[start:start + len(batch)] = np.bincount(hits[:, 0].astype(np.int32),
+                                                           minlength=len(batch))
+        return counts
 
-    classIds, confs, bbox = net.detect(img, confThreshold= thresh)
+
+_default_detector = None
+
+def get_detector():
+    """returns the shared PersonDetector, loading the model on first use"""
+    global _default_detector
+    if _default_detector is None:
+        _default_detector = PersonDetector()
+    return _default_detector
+
+def detect(image):
+    """image: image file -> <numpy.ndarray> integer classIds """
+    img = cv2.imread(image)
+    classIds = get_detector().detect(img)
     # Uncomment to visualize object detection with bounding box
     # for classId, confidence, box in zip(classIds.flatten(),confs.flatten(),bbox):
     #     cv2.rectangle(img, box, color=(0, 255, 0), thickness=2)
@@ -37,12 +109,10 @@ def detect(image):
     return classIds
 
 def people_count(classId_arr):
-    cnt = 0
-    for object in classId_arr.flatten():
-        if object == 1:
-            cnt += 1
-    print('{} person'.format(cnt))
+    """classId_arr: <numpy.ndarray> classIds from detect() -> (int) number of people"""
+    return int(np.count_nonzero(np.asarray(classId_arr).flatten() == PERSON_CLASS_ID))
 
 #For testing
 # if __name__ == '__main__':
-#     img1_object_arr = detect("1024px-usmc-120205-m-av740-004copy.jpg")
\ No newline at end of file
+#     img1_object_arr = detect("1024px-usmc-120205-m-av740-004copy.jpg")
+#     counts = get_detector().count_people("../images")
@@ -1,10 +1,19 @@
 from flask import Flask
+from flask import Response
 from flask import request
+from flask import stream_with_context
 from Model import db
+from Model import wire
+from Model.window import RollingWindows
+import csv
+import gzip
+import io
 import json
-import statistics
 
 DB = db.DatabaseDriver()
+# Recent counts kept in memory so /getcurrent/ never reads the database
+# after the first request
+WINDOWS = RollingWindows()
 app = Flask(__name__)
 
 def success_response(data, code=200):
@@ -17,37 +26,195 @@ def failure_response(data, code=404):
 def success():
     return "Successfully connected to DB"
 
+EXPORT_FIELDS = ["id", "number_ppl", "time", "date", "timestamp", "device"]
+
+def export_args():
+    """Reads ?after_id=&since= -> (after_id, since), raises ValueError on bad input"""
+    after_id = request.args.get("after_id", 0, type=int)
+    since = request.args.get("since", type=int)
+    if after_id < 0:
+        raise ValueError("after_id must not be negative")
+    return after_id, since
+
 @app.route("/getdb/")
 def getdb():
-    return success_response(DB.get_all())
+    """Pages with ?limit= (and ?after_id=, ?since=), otherwise streams the whole table"""
+    try:
+        after_id, since = export_args()
+    except ValueError as err:
+        return failure_response(str(err), 400)
+    limit = request.args.get("limit", type=int)
+    if limit is not None:
+        page = DB.get_page(after_id, max(1, min(limit, 5000)), since)
+        next_after_id = page[-1]["id"] if page else after_id
+        return success_response({"rows": page, "next_after_id": next_after_id})
+
+    def generate():
+        yield '{"success": true, "data": ['
+        for i, row in enumerate(DB.iter_rows(after_id, since)):
+            yield ("," if i else "") + json.dumps(row)
+        yield "]}"
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+@app.route("/export/ndjson/")
+def export_ndjson():
+    """One JSON object per line, ?after_id= and ?since= for incremental sync"""
+    try:
+        after_id, since = export_args()
+    except ValueError as err:
+        return failure_response(str(err), 400)
+
+    def generate():
+        for row in DB.iter_rows(after_id, since):
+            yield json.dumps(row) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/export/csv/")
+def export_csv():
+    """CSV with a header row, ?after_id= and ?since= for incremental sync"""
+    try:
+        after_id, since = export_args()
+    except ValueError as err:
+        return failure_response(str(err), 400)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for row in DB.iter_rows(after_id, since):
+            writer.writerow(row)
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    return Response(stream_with_context(generate()), mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=export.csv"})
+
+# SQLite stores INTEGER columns as signed 64 bit values
+INT64_MAX = 2 ** 63 - 1
+
+def valid_count(value):
+    """Whether value is an int that fits a non-negative INTEGER column"""
+    return type(value) == int and 0 <= value <= INT64_MAX
 
 @app.route("/add/", methods=["POST"])
 def add():
     body = json.loads(request.data)
     number = body.get("number_ppl")
+    device = body.get("device", "default")
     if type(number) != int:
         return failure_response("Invalid Type, Not an Integer")
+    elif not valid_count(number):
+        return failure_response("number_ppl must be between 0 and {}".format(INT64_MAX), 400)
+    elif type(device) != str:
+        return failure_response("Invalid Type, Device is not a String")
     else:
-        return success_response(DB.add_data(number),201)
+        try:
+            id, _ = DB.insert(number, device)
+        except Exception:
+            return success_response("error", 201)
+        WINDOWS.push(number, id)
+        return success_response("<successfully added: {}>".format(number), 201)
+
+MAX_BATCH_SAMPLES = 10000
+
+@app.route("/add/batch/", methods=["POST"])
+def add_batch():
+    """
+    {"device": str, "samples": [{"seq": int, "ts": int, "number_ppl": int}, ...]},
+    optionally sent with Content-Encoding: gzip, or the same batch in the
+    binary encoding of Model/wire.py with Content-Type application/x-pcnt.
+    Retried batches are safe, samples already stored for the device/seq are
+    skipped
+    """
+    if request.mimetype == wire.CONTENT_TYPE:
+        try:
+            device, samples = wire.decode(request.get_data())
+        except wire.WireError as err:
+            return failure_response("Invalid binary batch: {}".format(err), 400)
+    else:
+        try:
+            data = request.get_data()
+            if request.headers.get("Content-Encoding", "").lower() == "gzip":
+                data = gzip.decompress(data)
+            body = json.loads(data)
+        except (OSError, ValueError):
+            return failure_response("Invalid body, expected (gzipped) JSON", 400)
+        device = body.get("device") if isinstance(body, dict) else None
+        samples = body.get("samples") if isinstance(body, dict) else None
+    if type(device) != str or not device:
+        return failure_response("Invalid Type, Device is not a String", 400)
+    if type(samples) != list or len(samples) > MAX_BATCH_SAMPLES:
+        return failure_response("samples must be a list of at most {}".format(MAX_BATCH_SAMPLES), 400)
+    for index, sample in enumerate(samples):
+        if type(sample) != dict or any(type(sample.get(key)) != int for key in ("seq", "ts", "number_ppl")):
+            return failure_response("Every sample needs integer seq, ts and number_ppl", 400)
+        # Checked before anything reaches the writer, out of range values
+        # would otherwise only fail inside SQLite
+        if not all(valid_count(sample[key]) for key in ("seq", "ts", "number_ppl")):
+            return failure_response("Sample {}: seq, ts and number_ppl must be between 0 and {}".format(
+                index, INT64_MAX), 400)
+    rows = DB.insert_batch(device, samples)
+    # Stored rows extend the cached window in id order, whatever their timestamps
+    for id, _, number in rows:
+        WINDOWS.push(number, id)
+    return success_response({"inserted": len(rows), "duplicates": len(samples) - len(rows)}, 201)
 
 @app.route("/delete/<int:id>/", methods=["DELETE"])
 def delete(id):
     if DB.find(id) == None:
         return failure_response("Invalid id!")
     else:
-        return success_response(DB.delete(id))
+        result = DB.delete(id)
+        WINDOWS.invalidate()
+        return success_response(result)
+
+@app.route("/range/")
+def get_range():
+    """?start=&end= epoch seconds, optional &bucket= seconds (default 3600) and &device="""
+    start = request.args.get("start", type=int)
+    end = request.args.get("end", type=int)
+    bucket = request.args.get("bucket", 3600, type=int)
+    if start is None or end is None:
+        return failure_response("start and end must be integer timestamps", 400)
+    if bucket <= 0 or end <= start:
+        return failure_response("bucket must be positive and end after start", 400)
+    return success_response(DB.get_range(start, end, bucket, request.args.get("device")))
+
+@app.route("/rollup/")
+def get_rollup():
+    """?start=&end= epoch seconds, optional &resolution= seconds (default 3600), &device=, &histogram=1"""
+    start = request.args.get("start", type=int)
+    end = request.args.get("end", type=int)
+    resolution = request.args.get("resolution", 3600, type=int)
+    if start is None or end is None or end <= start:
+        return failure_response("start and end must be integer timestamps, end after start", 400)
+    try:
+        buckets = DB.get_rollup(start, end, resolution, request.args.get("device"),
+                                request.args.get("histogram") == "1")
+    except ValueError as err:
+        return failure_response(str(err), 400)
+    return success_response(buckets)
 
 @app.route("/getcurrent/")
 def get_current_number_of_people():
-    dict_list = DB.get_most_recent(5)
-    temp = []
-    for row in dict_list:
-        num = row.get("number_ppl")
-        temp.append(num)
-    median_count = {
-        "median_number_of_ppl": statistics.median(temp)
-    }
-    return success_response(median_count)
+    """Median of the last ?n= counts (default 5), plus any ?percentiles=25,90"""
+    n = request.args.get("n", 5, type=int)
+    try:
+        percentiles = [float(p) for p in request.args.get("percentiles", "").split(",") if p]
+    except ValueError:
+        return failure_response("percentiles must be numbers", 400)
+    if n <= 0 or any(not 0 <= p <= 100 for p in percentiles):
+        return failure_response("n must be positive and percentiles between 0 and 100", 400)
+    # Cold start (or after a delete), the only time this endpoint touches
+    # the database
+    WINDOWS.ensure_loaded(lambda: [(row["id"], row["number_ppl"])
+                                   for row in reversed(DB.get_most_recent(WINDOWS.max_size))])
+    summary = WINDOWS.summary(n, percentiles)
+    if summary["samples"] == 0:
+        return failure_response("No data yet")
+    return success_response(summary)
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -1,88 +1,517 @@
 import sqlite3
+import threading
 import time
+from contextlib import contextmanager
+from queue import Queue, LifoQueue, Empty, Full
+
+DB_PATH = "Model/photos.db"
+
+# Statements are kept as constants so sqlite3's per-connection statement
+# cache hands back the already prepared statement on every call
+INSERT_SAMPLE = "INSERT INTO samples (ts, device, number_ppl) VALUES (:ts, :device, :number_ppl)"
+# Replayed device batches skip (device, seq) pairs that are already stored
+INSERT_SEQUENCED_SAMPLE = """
+    INSERT OR IGNORE INTO samples (ts, device, number_ppl, seq) VALUES (:ts, :device, :number_ppl, :seq)
+"""
+SELECT_BY_ID = "SELECT id, ts, device, number_ppl FROM samples WHERE id = ?"
+SELECT_ALL = "SELECT id, ts, device, number_ppl FROM samples"
+SELECT_PAGE = """
+    SELECT id, ts, device, number_ppl FROM samples
+    WHERE id > :after_id AND (:since IS NULL OR ts >= :since)
+    ORDER BY id LIMIT :limit
+"""
+# Most recently stored, which is what the /getcurrent/ window follows
+SELECT_RECENT = "SELECT id, ts, device, number_ppl FROM samples ORDER BY id DESC LIMIT ?"
+DELETE_BY_ID = "DELETE FROM samples WHERE id = ?"
+
+# Pre-aggregated minute/hour/day buckets, updated with every sample
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+UPSERT_ROLLUP = """
+    INSERT INTO rollups (resolution, device, bucket, n, total, min, max)
+    VALUES (:resolution, :device, :ts - :ts % :resolution, 1, :number_ppl, :number_ppl, :number_ppl)
+    ON CONFLICT (resolution, device, bucket) DO UPDATE SET
+        n = n + 1, total = total + excluded.total,
+        min = MIN(min, excluded.min), max = MAX(max, excluded.max)
+"""
+UPSERT_ROLLUP_HIST = """
+    INSERT INTO rollup_hist (resolution, device, bucket, value, n)
+    VALUES (:resolution, :device, :ts - :ts % :resolution, :number_ppl, 1)
+    ON CONFLICT (resolution, device, bucket, value) DO UPDATE SET n = n + 1
+"""
+# Removing a sample decrements the histogram and recomputes min/max from it
+DECREMENT_ROLLUP_HIST = """
+    UPDATE rollup_hist SET n = n - 1
+    WHERE resolution = :resolution AND device = :device AND bucket = :ts - :ts % :resolution
+      AND value = :number_ppl
+"""
+PRUNE_ROLLUP_HIST = "DELETE FROM rollup_hist WHERE n <= 0"
+DECREMENT_ROLLUP = """
+    UPDATE rollups SET n = n - 1, total = total - :number_ppl,
+        min = COALESCE((SELECT MIN(value) FROM rollup_hist h WHERE h.resolution = rollups.resolution
+                        AND h.device = rollups.device AND h.bucket = rollups.bucket), min),
+        max = COALESCE((SELECT MAX(value) FROM rollup_hist h WHERE h.resolution = rollups.resolution
+                        AND h.device = rollups.device AND h.bucket = rollups.bucket), max)
+    WHERE resolution = :resolution AND device = :device AND bucket = :ts - :ts % :resolution
+"""
+PRUNE_ROLLUPS = "DELETE FROM rollups WHERE n <= 0"
+SELECT_ROLLUP = """
+    SELECT :start + (bucket - :start) / :bucket * :bucket AS b, SUM(n), SUM(total), MIN(min), MAX(max)
+    FROM rollups
+    WHERE resolution = :resolution AND bucket >= :start AND bucket < :end
+      AND (:device IS NULL OR device = :device)
+    GROUP BY b ORDER BY b
+"""
+SELECT_ROLLUP_HIST = """
+    SELECT :start + (bucket - :start) / :bucket * :bucket AS b, value, SUM(n)
+    FROM rollup_hist
+    WHERE resolution = :resolution AND bucket >= :start AND bucket < :end
+      AND (:device IS NULL OR device = :device)
+    GROUP BY b, value ORDER BY b, value
+"""
+
+# Counts bucketed into fixed intervals. The window functions number the rows
+# of each bucket in count order so the median is the middle row (or the mean
+# of the two middle rows)
+SELECT_RANGE = """
+    WITH bucketed AS (
+        SELECT (ts - :start) / :bucket AS bucket, number_ppl FROM samples
+        WHERE ts >= :start AND ts < :end AND (:device IS NULL OR device = :device)
+    ), ranked AS (
+        SELECT bucket, number_ppl,
+               ROW_NUMBER() OVER (PARTITION BY bucket ORDER BY number_ppl) AS rn,
+               COUNT(*) OVER (PARTITION BY bucket) AS n
+        FROM bucketed
+    )
+    SELECT :start + bucket * :bucket, COUNT(*), MIN(number_ppl), MAX(number_ppl), AVG(number_ppl),
+           AVG(CASE WHEN rn IN ((n + 1) / 2, (n + 2) / 2) THEN number_ppl END)
+    FROM ranked GROUP BY bucket ORDER BY bucket
+"""
+
+
+class _PendingWrite:
+    """An insert waiting for the group commit that makes it durable"""
+    __slots__ = ("sql", "params", "extra", "done", "rowid", "error")
+
+    def __init__(self, sql, params, extra=()):
+        self.sql = sql
+        self.params = params
+        self.extra = extra
+        self.done = threading.Event()
+        self.rowid = None
+        self.error = None
+
+
+class GroupCommitWriter(threading.Thread):
+    '''
+    Single writer thread. Inserts queued by concurrent requests are run in
+    one transaction and committed together, callers block until the commit
+    holding their row has finished. Each write runs in its own savepoint, so
+    one that fails is rolled back and reported alone. Writes arriving while a commit is in
+    flight form the next group; max_delay optionally waits for more.
+    '''
+    def __init__(self, connect, max_batch=256, max_delay=0.0):
+        super().__init__(name="db-writer", daemon=True)
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = Queue()
+        self.commits = 0
+
+    def submit(self, sql, params, extra=()):
+        """
+        Queues a write, plus extra (sql, params) statements that must land in
+        the same transaction, and waits for it to be committed -> (int) rowid.
+        sql may instead be a callable taking the connection, its return value
+        is handed back in place of the rowid
+        """
+        write = _PendingWrite(sql, params, extra)
+        self.queue.put(write)
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.rowid
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0
+                             else self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _apply(conn, write):
+        """Runs one write inside its own savepoint, so a failure only undoes that write"""
+        conn.execute("SAVEPOINT write")
+        try:
+            if callable(write.sql):
+                write.rowid = write.sql(conn)
+            else:
+                write.rowid = conn.execute(write.sql, write.params).lastrowid
+            for sql, params in write.extra:
+                conn.execute(sql, params)
+        except Exception as err:
+            write.error = err
+            conn.execute("ROLLBACK TO write")
+        conn.execute("RELEASE write")
+
+    def run(self):
+        conn = self.connect()
+        while True:
+            batch = self._collect()
+            try:
+                with conn:
+                    conn.execute("BEGIN")
+                    for write in batch:
+                        self._apply(conn, write)
+                self.commits += 1
+            except Exception as err:
+                # The commit itself failed, nothing of the group was stored
+                for write in batch:
+                    write.error = err
+            for write in batch:
+                write.done.set()
+
+
+class ConnectionPool:
+    """
+    Idle connections handed out to whichever thread needs one. Flask's dev
+    server starts a thread per request, so per-thread connections would be
+    opened and thrown away on every request; at most max_idle are kept
+    """
+    def __init__(self, connect, max_idle=8):
+        self.connect = connect
+        self.idle = LifoQueue(max_idle)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except Empty:
+            conn = self.connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self.idle.put_nowait(conn)
+            except Full:
+                conn.close()
+
 
 class DatabaseDriver:
     '''
     Database driver for connecting to our DB,
-    pushing photos to the DB and getting data
+    pushing photos to the DB and getting data.
+    Connections are borrowed from a small pool, the database runs in WAL mode so
+    readers never block the writer, and inserts go through one group
+    committing writer thread
     '''
-    def __init__(self):
-        self.conn = sqlite3.connect("Model/photos.db", check_same_thread=False)
-        self.c = self.conn.cursor() #TODO WHAT IS A CURSOR?
+    def __init__(self, path=None, timeout=10.0):
+        # Read at call time so tools can point DB_PATH elsewhere before importing routes
+        self.path = path or DB_PATH
+        self.timeout = timeout
+        self.pool = ConnectionPool(self._connect)
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+        self.create_table()
+        self.writer = GroupCommitWriter(self._connect)
+        self.writer.start()
+
+    def _connect(self):
+        # The pool hands a connection to one thread at a time, across threads
+        conn = sqlite3.connect(self.path, timeout=self.timeout, cached_statements=64,
+                               check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout={}".format(int(self.timeout * 1000)))
+        return conn
+
+    def connection(self):
+        """Context manager borrowing a pooled connection"""
+        return self.pool.connection()
+
+    def _query(self, sql, params=()):
+        """-> (list) every row of a read on a pooled connection"""
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _format(row):
+        id, ts, device, number_ppl = row
+        local = time.localtime(ts)
+        return {
+            "id": id,
+            "number_ppl": number_ppl,
+            "time": time.strftime("%X", local),
+            "date": time.strftime("%x", local),
+            "timestamp": ts,
+            "device": device
+        }
 
     def create_table(self):
-        """To create our table"""
-        try:
-            self.c.execute("""
-                CREATE TABLE info (
+        """To create our table, migrating rows from the old text based info table"""
+        with self.connection() as conn, conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'samples'").fetchone()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS samples (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                number_ppl INTEGER,
-                time TEXT NOT NULL,
-                date TEXT NOT NULL
+                ts INTEGER NOT NULL,
+                device TEXT NOT NULL DEFAULT 'default',
+                number_ppl INTEGER NOT NULL
                 )
             """)
-            self.conn.commit()
-            return ("table successfully created")
-        except Exception:
-            return("table has already been created")
+            # Covers range queries and bucketing without touching the table
+            conn.execute("CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts, device, number_ppl)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rollups (
+                resolution INTEGER NOT NULL,
+                device TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                n INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                min INTEGER NOT NULL,
+                max INTEGER NOT NULL,
+                PRIMARY KEY (resolution, bucket, device)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_hist (
+                resolution INTEGER NOT NULL,
+                device TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                n INTEGER NOT NULL,
+                PRIMARY KEY (resolution, bucket, device, value)
+                )
+            """)
+            # Settings of the database itself, e.g. how far raw samples were pruned
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(samples)")]
+            if "seq" not in columns:
+                conn.execute("ALTER TABLE samples ADD COLUMN seq INTEGER")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS samples_device_seq ON samples (device, seq)")
+        migrated = self.migrate()
+        self.rebuild_rollups(only_if_empty=True)
+        if exists:
+            return "table has already been created"
+        return "table successfully created, migrated {} rows".format(migrated)
+
+    def migrate(self):
+        """
+        Copies rows of the legacy info table (locale formatted time/date text)
+        into samples as epoch timestamps, keeping their ids, then renames
+        it to info_legacy -> (int) rows migrated
+        """
+        with self.connection() as conn, conn:
+            legacy = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'info'").fetchone()
+            if legacy is None:
+                return 0
+            rows = []
+            for id, number_ppl, row_time, row_date in conn.execute(
+                    "SELECT id, number_ppl, time, date FROM info"):
+                try:
+                    ts = int(time.mktime(time.strptime("{} {}".format(row_date, row_time), "%x %X")))
+                except ValueError:
+                    print("Skipping unparseable row {}: {} {}".format(id, row_date, row_time))
+                    continue
+                rows.append((id, ts, "default", number_ppl))
+            conn.executemany(
+                "INSERT OR IGNORE INTO samples (id, ts, device, number_ppl) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("ALTER TABLE info RENAME TO info_legacy")
+        return len(rows)
+
+    def rebuild_rollups(self, only_if_empty=False):
+        """
+        Recomputes the rollup buckets from the raw samples. Once prune_raw
+        has run, buckets starting before the pruned horizon only exist in the
+        rollups and are kept as they are
+        """
+        with self.connection() as conn, conn:
+            if only_if_empty and conn.execute("SELECT 1 FROM rollups LIMIT 1").fetchone():
+                return
+            pruned_before = self._pruned_before(conn)
+            for resolution in ROLLUP_RESOLUTIONS:
+                if pruned_before is None:
+                    first = -2 ** 63
+                else:
+                    # The first bucket whose samples are all still stored
+                    first = -(-pruned_before // resolution) * resolution
+                conn.execute("DELETE FROM rollups WHERE resolution = ? AND bucket >= ?", (resolution, first))
+                conn.execute("DELETE FROM rollup_hist WHERE resolution = ? AND bucket >= ?", (resolution, first))
+                conn.execute("""
+                    INSERT INTO rollups (resolution, device, bucket, n, total, min, max)
+                    SELECT ?1, device, ts - ts % ?1, COUNT(*), SUM(number_ppl), MIN(number_ppl), MAX(number_ppl)
+                    FROM samples WHERE ts >= ?2 GROUP BY device, ts - ts % ?1
+                """, (resolution, first))
+                conn.execute("""
+                    INSERT INTO rollup_hist (resolution, device, bucket, value, n)
+                    SELECT ?1, device, ts - ts % ?1, number_ppl, COUNT(*)
+                    FROM samples WHERE ts >= ?2 GROUP BY device, ts - ts % ?1, number_ppl
+                """, (resolution, first))
+
+    @staticmethod
+    def _pruned_before(conn):
+        """-> (int) timestamp raw samples were pruned up to, None if never"""
+        row = conn.execute("SELECT value FROM meta WHERE key = 'pruned_before'").fetchone()
+        return None if row is None else row[0]
+
+    @staticmethod
+    def _rollup_statements(sample, statements):
+        """(sql, params) pairs applying statements to every rollup resolution"""
+        return [(sql, dict(sample, resolution=resolution))
+                for resolution in ROLLUP_RESOLUTIONS for sql in statements]
 
-    def add_data(self, num):
+    def add_data(self, num, device="default", ts=None):
         """
         :param num: number of people in image
+        :param device: id of the reporting device
+        :param ts: epoch seconds of the sample, defaults to now
         -> (string) success/failure response message
         """
-        current_time = time.strftime("%X")
-        date = time.strftime("%x")
         try:
-            self.c.execute("INSERT INTO info (number_ppl, time, date) VALUES (:number_ppl, :time, :date)"
-                           ,{"number_ppl": num, "time": current_time, "date": date })
-            self.conn.commit()
+            self.insert(num, device, ts)
             return "<successfully added: {}>".format(num)
-        except:
+        except Exception:
             return "error"
 
+    def insert(self, num, device="default", ts=None):
+        """Like add_data but raises on failure -> (tuple) (row id, ts)"""
+        ts = int(time.time()) if ts is None else int(ts)
+        sample = {"ts": ts, "device": device, "number_ppl": num}
+        rowid = self.writer.submit(INSERT_SAMPLE, sample,
+                                   self._rollup_statements(sample, (UPSERT_ROLLUP, UPSERT_ROLLUP_HIST)))
+        return rowid, ts
+
+    def add_batch(self, device, samples):
+        """
+        device:(string), samples:(dict list) with integer seq, ts and number_ppl
+        -> (tuple) (inserted, duplicates). The batch is one transaction; samples
+        whose (device, seq) is already stored are skipped
+        """
+        inserted = len(self.insert_batch(device, samples))
+        return inserted, len(samples) - inserted
+
+    def insert_batch(self, device, samples):
+        """Like add_batch -> (list) (row id, ts, number_ppl) of the samples actually stored"""
+        def insert(conn):
+            rows = []
+            for sample in samples:
+                sample = {"ts": sample["ts"], "device": device, "number_ppl": sample["number_ppl"],
+                          "seq": sample["seq"]}
+                cursor = conn.execute(INSERT_SEQUENCED_SAMPLE, sample)
+                if cursor.rowcount:
+                    rows.append((cursor.lastrowid, sample["ts"], sample["number_ppl"]))
+                    for sql, params in self._rollup_statements(sample, (UPSERT_ROLLUP, UPSERT_ROLLUP_HIST)):
+                        conn.execute(sql, params)
+            return rows
+        return self.writer.submit(insert, None)
+
     def find(self, id):
         """id:(integer) -> (dict) row specified by id"""
-        self.c.execute("SELECT * FROM info WHERE id = ?", (id,))
-        row = self.c.fetchone()
-        if row == None:
+        rows = self._query(SELECT_BY_ID, (id,))
+        if not rows:
             return None
         else:
-            format = {
-                "id": row[0],
-                "number_ppl": row[1],
-                "time": row[2],
-                "date": row[3]
-            }
-            return format
+            return self._format(rows[0])
 
     def get_all(self):
         """returns all entries in database (dict)"""
-        table = self.c.execute("SELECT * FROM info")
-        store = []
-        for row in table:
-            temp = {
-                "id": row[0],
-                "number_ppl":row[1],
-                "time":row[2],
-                "date":row[3]
-            }
-            store.append(temp)
-        return store
+        return [self._format(row) for row in self._query(SELECT_ALL)]
+
+    def get_page(self, after_id=0, limit=500, since=None):
+        """
+        after_id:(integer) last id already seen, since:(integer) optional epoch
+        seconds -> (dict list) next limit rows in id order
+        """
+        params = {"after_id": after_id, "limit": limit, "since": since}
+        return [self._format(row) for row in self._query(SELECT_PAGE, params)]
+
+    def iter_rows(self, after_id=0, since=None, page_size=500):
+        """Yields every row after after_id (and from since) one keyset page at a time"""
+        while True:
+            page = self.get_page(after_id, page_size, since)
+            yield from page
+            if len(page) < page_size:
+                return
+            after_id = page[-1]["id"]
 
     def get_most_recent(self, n):
-        """n:(integer) -> (dict list) n most recent entries"""
-        cursor = self.c.execute("SELECT * FROM info ORDER BY id DESC LIMIT ?", (n,))
-        store = []
-        for row in cursor:
-            temp = {
-                "id": row[0],
-                "number_ppl":row[1],
-                "time":row[2],
-                "date":row[3]
-            }
-            store.append(temp)
-        return store
+        """n:(integer) -> (dict list) n most recently stored entries, newest first"""
+        return [self._format(row) for row in self._query(SELECT_RECENT, (n,))]
+
+    def get_range(self, start, end, bucket, device=None):
+        """
+        start, end:(integer) epoch seconds, bucket:(integer) seconds per bucket
+        -> (dict list) count/min/max/mean/median of every non-empty bucket
+        """
+        params = {"start": start, "end": end, "bucket": bucket, "device": device}
+        return [{
+            "start": bucket_start,
+            "count": count,
+            "min": minimum,
+            "max": maximum,
+            "mean": mean,
+            "median": median
+        } for bucket_start, count, minimum, maximum, mean, median in self._query(SELECT_RANGE, params)]
+
+    def get_rollup(self, start, end, resolution, device=None, histogram=False):
+        """
+        start, end:(integer) epoch seconds, resolution:(integer) seconds per bucket
+        -> (dict list) count/min/max/mean per bucket, read from the coarsest
+        rollup that evenly divides the requested resolution
+        """
+        stored = max([r for r in ROLLUP_RESOLUTIONS if resolution % r == 0], default=None)
+        if stored is None:
+            raise ValueError("resolution must be a multiple of {} seconds".format(ROLLUP_RESOLUTIONS[0]))
+        params = {"start": start - start % stored, "end": end, "bucket": resolution,
+                  "resolution": stored, "device": device}
+        with self.connection() as conn:
+            # One read transaction, so both queries see the same snapshot
+            # even while the writer commits in between
+            conn.execute("BEGIN")
+            try:
+                rows = conn.execute(SELECT_ROLLUP, params).fetchall()
+                hist = conn.execute(SELECT_ROLLUP_HIST, params).fetchall() if histogram else ()
+            finally:
+                conn.rollback()
+        buckets = [{
+            "start": bucket_start,
+            "count": n,
+            "min": minimum,
+            "max": maximum,
+            "mean": total / n
+        } for bucket_start, n, total, minimum, maximum in rows]
+        if histogram:
+            by_start = {bucket["start"]: bucket for bucket in buckets}
+            for bucket_start, value, n in hist:
+                if bucket_start in by_start:
+                    by_start[bucket_start].setdefault("histogram", {})[value] = n
+        return buckets
+
+    def prune_raw(self, older_than):
+        """
+        older_than:(integer) epoch seconds -> (int) raw samples deleted. Their
+        counts stay in the rollups, and the horizon is recorded so
+        rebuild_rollups never recomputes those buckets from the samples left
+        """
+        with self.connection() as conn, conn:
+            conn.execute("""
+                INSERT INTO meta (key, value) VALUES ('pruned_before', ?1)
+                ON CONFLICT (key) DO UPDATE SET value = MAX(value, ?1)
+            """, (older_than,))
+            return conn.execute("DELETE FROM samples WHERE ts < ?", (older_than,)).rowcount
 
     def delete(self, id):
         """
@@ -91,13 +520,18 @@ class DatabaseDriver:
         if temp == None:
             return "Failed to delete, No id found!"
         else:
-            self.c.execute("DELETE FROM info WHERE id = ?",(id,))
-            self.conn.commit()
+            sample = {"ts": temp["timestamp"], "device": temp["device"], "number_ppl": temp["number_ppl"]}
+            self.writer.submit(DELETE_BY_ID, (id,), self._rollup_statements(
+                sample, (DECREMENT_ROLLUP_HIST, PRUNE_ROLLUP_HIST, DECREMENT_ROLLUP, PRUNE_ROLLUPS)))
             return "Deleted : {}".format(temp)
 
     def drop_table(self):
         try:
-            self.c.execute("DROP TABLE info")
+            with self.connection() as conn, conn:
+                conn.execute("DROP TABLE samples")
+                conn.execute("DROP TABLE IF EXISTS rollups")
+                conn.execute("DROP TABLE IF EXISTS rollup_hist")
+                conn.execute("DROP TABLE IF EXISTS meta")
             return "table dropped!"
         except Exception:
             return "Error, table not found"
@@ -0,0 +1,126 @@
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+
+
+class RollingWindow:
+    '''
+    The last `size` counts kept both in arrival order and sorted, so the
+    median and percentiles are a direct index into the sorted copy
+    '''
+    def __init__(self, size, values=()):
+        self.size = size
+        self.values = deque()
+        self.sorted = []
+        for value in values:
+            self.push(value)
+
+    def push(self, value):
+        """Adds a count, evicting the oldest once the window is full"""
+        self.values.append(value)
+        insort(self.sorted, value)
+        if len(self.values) > self.size:
+            oldest = self.values.popleft()
+            del self.sorted[bisect_left(self.sorted, oldest)]
+
+    def __len__(self):
+        return len(self.values)
+
+    def median(self):
+        """-> (number) median of the window, None when empty"""
+        n = len(self.sorted)
+        if n == 0:
+            return None
+        middle = n // 2
+        if n % 2:
+            return self.sorted[middle]
+        return (self.sorted[middle - 1] + self.sorted[middle]) / 2
+
+    def percentile(self, p):
+        """p:(number) 0-100 -> (number) linearly interpolated percentile, None when empty"""
+        n = len(self.sorted)
+        if n == 0:
+            return None
+        rank = (n - 1) * p / 100
+        low = int(rank)
+        high = min(low + 1, n - 1)
+        return self.sorted[low] + (self.sorted[high] - self.sorted[low]) * (rank - low)
+
+
+class RollingWindows:
+    '''
+    Rolling windows of several sizes fed from one in-memory history of the
+    most recent counts. A window for a new size is built from the history
+    without touching the database; the least recently used sizes are
+    dropped beyond max_windows.
+
+    The history is seeded from the database and pushed to under one lock,
+    both in row id (arrival) order, so samples from devices with their own
+    clocks or late spooled batches simply extend it. The newest row id the
+    seed read keeps a row it already holds from being pushed twice
+    '''
+    def __init__(self, max_size=1000, max_windows=8):
+        self.max_size = max_size
+        self.max_windows = max_windows
+        self.history = deque(maxlen=max_size)
+        self.windows = OrderedDict()
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.seeded_id = 0
+
+    def seed(self, rows):
+        """rows:(list) (id, count) oldest first, replaces the history"""
+        with self.lock:
+            self._seed(rows)
+
+    def _seed(self, rows):
+        self.history.clear()
+        self.history.extend(count for _, count in rows)
+        self.windows.clear()
+        self.seeded_id = max((id for id, _ in rows), default=0)
+        self.loaded = True
+
+    def ensure_loaded(self, load):
+        """Seeds the history from load() -> (id, count) rows when it is stale"""
+        with self.lock:
+            if not self.loaded:
+                self._seed(load())
+
+    def invalidate(self):
+        """Marks the history stale so the next reader seeds it again"""
+        with self.lock:
+            self.loaded = False
+
+    def push(self, value, id):
+        """Adds a freshly stored count, id:(integer) its row id"""
+        with self.lock:
+            if not self.loaded or id <= self.seeded_id:
+                # The next seed reads it, or the last one already did
+                return
+            self.history.append(value)
+            for window in self.windows.values():
+                window.push(value)
+
+    def window(self, size):
+        """size:(integer) -> (RollingWindow) of the last size counts"""
+        size = max(1, min(size, self.max_size))
+        with self.lock:
+            window = self.windows.get(size)
+            if window is None:
+                start = max(len(self.history) - size, 0)
+                window = RollingWindow(size, list(self.history)[start:])
+                self.windows[size] = window
+                if len(self.windows) > self.max_windows:
+                    self.windows.popitem(last=False)
+            else:
+                self.windows.move_to_end(size)
+            return window
+
+    def summary(self, size, percentiles=()):
+        """-> (dict) median (and requested percentiles) of the last size counts"""
+        window = self.window(size)
+        with self.lock:
+            summary = {"median_number_of_ppl": window.median(), "samples": len(window)}
+            for p in percentiles:
+                summary["p{:g}".format(p)] = window.percentile(p)
+        return summary
@@ -0,0 +1,63 @@
+'''
+Decoder for the binary sample batches devices post to /add/batch/ with
+Content-Type application/x-pcnt, the server half of
+tensor-flow/package/wire.py (see there for the frame layout). Keep the two
+in step and bump VERSION on any layout change.
+'''
+import struct
+import zlib
+
+MAGIC = b'PCNT'
+VERSION = 1
+CONTENT_TYPE = 'application/x-pcnt'
+
+HEADER = struct.Struct('<4sBBH')
+BASE = struct.Struct('<qq')
+RECORD = struct.Struct('<HIh')
+TRAILER = struct.Struct('<I')
+
+
+class WireError(ValueError):
+    """Raised for payloads that are truncated, corrupt or of an unknown version"""
+
+
+def decode(payload):
+    """(bytes) -> (device_id, samples) of every frame in the payload, frames must share a device"""
+    device_id = None
+    samples = []
+    offset = 0
+    view = memoryview(payload)
+    while offset < len(payload):
+        start = offset
+        try:
+            magic, version, device_length, count = HEADER.unpack_from(view, offset)
+        except struct.error:
+            raise WireError("Truncated frame header")
+        if magic != MAGIC:
+            raise WireError("Bad magic")
+        if version != VERSION:
+            raise WireError(f"Unsupported version {version}")
+        offset += HEADER.size
+        end = offset + device_length + BASE.size + count * RECORD.size
+        if end + TRAILER.size > len(payload):
+            raise WireError("Truncated frame")
+        (crc,) = TRAILER.unpack_from(view, end)
+        if zlib.crc32(view[start:end]) != crc:
+            raise WireError("Checksum mismatch")
+        try:
+            device = bytes(view[offset:offset + device_length]).decode('utf-8')
+        except UnicodeDecodeError:
+            raise WireError("Device id is not utf-8")
+        if device_id is not None and device != device_id:
+            raise WireError("Frames from different devices")
+        device_id = device
+        offset += device_length
+        base_ts, seq = BASE.unpack_from(view, offset)
+        offset += BASE.size
+        number_ppl = 0
+        for seq_delta, ts_delta, count_delta in RECORD.iter_unpack(view[offset:end]):
+            seq += seq_delta
+            number_ppl += count_delta
+            samples.append({'seq': seq, 'ts': base_ts + ts_delta, 'number_ppl': number_ppl})
+        offset = end + TRAILER.size
+    return device_id, samples
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from urllib import request as urlrequest
+
+
+def http_client(base_url):
+    """Returns call(method, path, body) -> status code against a running server"""
+    def call(method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urlrequest.Request(base_url.rstrip("/") + path, data=data, method=method)
+        with urlrequest.urlopen(req, timeout=10) as response:
+            response.read()
+            return response.status
+    return call
+
+
+def flask_client():
+    """
+    Same interface as http_client, served in-process by the Flask test
+    client over a scratch database, never the real Model/photos.db
+    """
+    from Model import db
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "photos.db")
+    from Controller.routes import app
+    local = threading.local()
+
+    def call(method, path, body=None):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        data = json.dumps(body) if body is not None else None
+        return local.client.open(path, method=method, data=data).status_code
+    return call
+
+
+def worker(call, method, path, body, deadline, latencies, errors):
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            status = call(method, path, body)
+            if status >= 400:
+                errors.append(status)
+        except Exception as err:
+            errors.append(repr(err))
+        latencies.append(time.monotonic() - started)
+
+
+def run(call, method, path, body, clients, duration):
+    """Hammers one endpoint from parallel clients -> (dict) throughput summary"""
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=worker, args=(call, method, path, body, deadline, latencies, errors))
+               for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return {
+        "endpoint": "{} {}".format(method, path),
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "req_per_s": round(len(latencies) / duration, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2) if latencies else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel client load test for /add/ and /getcurrent/")
+    parser.add_argument("--url", help="Base URL of a running server, defaults to an in-process test client")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    call = http_client(args.url) if args.url else flask_client()
+    for clients in args.clients:
+        print(json.dumps(run(call, "POST", "/add/", {"number_ppl": 3}, clients, args.duration)))
+        print(json.dumps(run(call, "GET", "/getcurrent/", None, clients, args.duration)))
+        # Readers and writers at the same time, the case that used to lock
+        mixed = {}
+        writers = threading.Thread(target=lambda: mixed.update(
+            add=run(call, "POST", "/add/", {"number_ppl": 3}, clients, args.duration)))
+        writers.start()
+        mixed["getcurrent"] = run(call, "GET", "/getcurrent/", None, clients, args.duration)
+        writers.join()
+        print(json.dumps({"mixed": mixed}))
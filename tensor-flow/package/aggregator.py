@@ -0,0 +1,137 @@
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import datetime
+from time import time
+
+
+class SlidingWindow(object):
+    """
+    Recent counts kept in arrival order and sorted, bounded by a number of
+    samples and/or an age in seconds
+    """
+    def __init__(self, size=None, seconds=None):
+        self.size = size
+        self.seconds = seconds
+        self.entries = deque()
+        self.sorted = []
+        self.total = 0
+
+    def add(self, value, ts):
+        self.entries.append((ts, value))
+        insort(self.sorted, value)
+        self.total += value
+        while self.entries and ((self.size is not None and len(self.entries) > self.size) or
+                                (self.seconds is not None and ts - self.entries[0][0] >= self.seconds)):
+            _, old = self.entries.popleft()
+            del self.sorted[bisect_left(self.sorted, old)]
+            self.total -= old
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def median(window, state):
+    n = len(window.sorted)
+    middle = n // 2
+    if n % 2:
+        return window.sorted[middle]
+    return (window.sorted[middle - 1] + window.sorted[middle]) / 2
+
+
+def trimmed_mean(window, state):
+    n = len(window.sorted)
+    cut = int(n * state['trim'])
+    if cut == 0:
+        return window.total / n
+    kept = window.sorted[cut:n - cut]
+    return sum(kept) / len(kept)
+
+
+def ewma(window, state):
+    return state['ewma']
+
+
+def maximum(window, state):
+    return window.sorted[-1]
+
+
+STATISTICS = {
+    'median': median,
+    'trimmed_mean': trimmed_mean,
+    'ewma': ewma,
+    'max': maximum,
+}
+
+
+class Aggregator(object):
+    """
+    Windowed aggregation of per-frame person counts.
+
+    The window holds the last window samples, or the last window_seconds
+    seconds when that is given. statistic is one of STATISTICS. In 'window'
+    mode a sample is emitted once per window (every window samples, or every
+    window_seconds); in 'change' mode one is emitted whenever the smoothed
+    count moves at least change_threshold away from the last emitted value,
+    or heartbeat seconds have passed without an emit.
+    """
+    def __init__(self, statistic='median', window=5, window_seconds=None, emit='window',
+                 change_threshold=1.0, heartbeat=600.0, alpha=0.3, trim=0.2, clock=time):
+        if statistic not in STATISTICS:
+            raise ValueError(f"Unknown statistic {statistic}, expected one of {', '.join(STATISTICS)}")
+        if emit not in ('window', 'change'):
+            raise ValueError(f"Unknown emit mode {emit}, expected window or change")
+        self.statistic = statistic
+        self.compute = STATISTICS[statistic]
+        self.window = SlidingWindow(None if window_seconds else window, window_seconds)
+        self.window_size = window
+        self.window_seconds = window_seconds
+        self.emit = emit
+        self.change_threshold = change_threshold
+        self.heartbeat = heartbeat
+        self.clock = clock
+        self.state = {'alpha': alpha, 'trim': trim, 'ewma': None}
+        self.since_emit = 0
+        self.last_emit_ts = None
+        self.last_value = None
+
+    @property
+    def value(self):
+        """Current smoothed count, None before the first sample"""
+        if not len(self.window):
+            return None
+        return self.compute(self.window, self.state)
+
+    def _due(self, value, ts):
+        if self.last_emit_ts is None:
+            self.last_emit_ts = ts
+        if self.emit == 'window':
+            if self.window_seconds:
+                return ts - self.last_emit_ts >= self.window_seconds
+            return self.since_emit >= self.window_size
+        if self.last_value is None or abs(value - self.last_value) >= self.change_threshold:
+            return True
+        return ts - self.last_emit_ts >= self.heartbeat
+
+    def add(self, count, ts=None):
+        """Adds one frame's count, returns the sample to upload or None"""
+        ts = self.clock() if ts is None else ts
+        self.window.add(count, ts)
+        alpha = self.state['alpha']
+        previous = self.state['ewma']
+        self.state['ewma'] = count if previous is None else alpha * count + (1 - alpha) * previous
+        self.since_emit += 1
+
+        value = self.value
+        if not self._due(value, ts):
+            return None
+        sample = {
+            # Kept under the name the server already reads
+            'mode': round(value, 2),
+            'statistic': self.statistic,
+            'samples': self.since_emit,
+            'timestamp': datetime.fromtimestamp(ts).isoformat(sep=' ', timespec='seconds'),
+        }
+        self.since_emit = 0
+        self.last_emit_ts = ts
+        self.last_value = value
+        return sample
@@ -79,6 +79,11 @@ class Annotator:
     self._overlay = None
     self._draw = ImageDraw.Draw(self._buffer)
     self._default_color = default_color or (0xFF, 0, 0, 0xFF)
+    # Regions drawn on since the last clear(), so only those get erased, and
+    # the drawing calls behind them, to skip updates that change nothing
+    self._dirty = []
+    self._drawn = []
+    self._shown = None
 
   def update(self):
     """Draws any changes to the image buffer onto the overlay."""
@@ -87,16 +92,32 @@ class Annotator:
     # overlay each time we want to update.
     # We use a temp overlay object because if we remove the current overlay
     # first, it causes flickering (the overlay visibly disappears for a moment).
+    # add_overlay already renders the source it is given, so the buffer is
+    # serialized once and not pushed a second time with update().
+    if self._drawn == self._shown:
+      return
+    self._shown = list(self._drawn)
     temp_overlay = self._camera.add_overlay(
         self._buffer.tobytes(), format='rgba', layer=3, size=self._buffer_dims)
     if self._overlay is not None:
       self._camera.remove_overlay(self._overlay)
     self._overlay = temp_overlay
-    self._overlay.update(self._buffer.tobytes())
+
+  def _mark_dirty(self, rect, *call, volatile=False):
+    if not volatile:
+      self._drawn.append(call)
+    x1, y1, x2, y2 = rect
+    self._dirty.append((min(x1, x2) - 1, min(y1, y2) - 1, max(x1, x2) + 1, max(y1, y2) + 1))
 
   def clear(self):
-    """Clears the contents of the overlay, leaving only the plain background."""
-    self._draw.rectangle((0,0) + self._dims, fill=(0, 0, 0, 0x00))
+    """Clears the contents of the overlay, leaving only the plain background.
+
+    Only the regions drawn on since the previous clear are erased.
+    """
+    for rect in self._dirty:
+      self._draw.rectangle(rect, fill=(0, 0, 0, 0x00))
+    self._dirty = []
+    self._drawn = []
 
   def bounding_box(self, rect, outline=None, fill=None):
     """Draws a bounding box around the specified rectangle.
@@ -111,8 +132,9 @@ class Annotator:
     """
     outline = outline or self._default_color
     self._draw.rectangle(rect, fill=fill, outline=outline)
+    self._mark_dirty(rect, 'box', tuple(rect), outline, fill)
 
-  def text(self, location, text, color=None):
+  def text(self, location, text, color=None, volatile=False):
     """Draws the given text at the given location.
 
     Args:
@@ -120,6 +142,10 @@ class Annotator:
       text: string to be drawn.
       color: PIL.ImageColor to draw the string in (defaults to the Annotator
         default_color).
+      volatile: text that changes every frame (e.g. a timing) and alone is no
+        reason to push an update; it is refreshed with the next change.
     """
     color = color or self._default_color
     self._draw.text(location, text, fill=color)
+    self._mark_dirty(self._draw.textbbox(tuple(location), text), 'text', tuple(location), text, color,
+                     volatile=volatile)
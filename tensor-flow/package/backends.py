@@ -0,0 +1,154 @@
+import os
+import numpy as np
+
+from detector import (Detector, DETECTION_DTYPE, PERSON_CLASS_ID, CAMERA_WIDTH, CAMERA_HEIGHT,
+                      annotate_objects)
+from metrics import REGISTRY
+
+OPENCV_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'opencv', 'Object_Detection_Files')
+
+BACKENDS = {}
+
+
+def register_backend(name):
+    """Class decorator adding a Backend subclass to the registry under name"""
+    def register(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return register
+
+
+class Backend(object):
+    """
+    Shared detector interface. Every backend returns DETECTION_DTYPE arrays
+    with boxes as relative [ymin, xmin, ymax, xmax] and people reported as
+    PERSON_CLASS_ID, whatever the underlying model's conventions are.
+    """
+    name = None
+
+    def __init__(self, threshold=0.4, labels=None):
+        self.threshold = threshold
+        self.labels = Detector.load_labels(labels) if labels else {PERSON_CLASS_ID: 'person'}
+
+    def load(self):
+        """Loads the model, raises if the runtime or model files are unavailable"""
+        raise NotImplementedError
+
+    @property
+    def capture_size(self):
+        """(width, height) frames should be captured at"""
+        raise NotImplementedError
+
+    def detect(self, batch):
+        """batch: list of HxWx3 RGB frames -> list of DETECTION_DTYPE arrays"""
+        raise NotImplementedError
+
+    def warm_up(self, runs=1):
+        """Runs blank frames through the model so the first real frame runs at full speed"""
+        width, height = self.capture_size
+        blank = np.zeros((height, width, 3), dtype=np.uint8)
+        for _ in range(runs):
+            self.detect([blank])
+
+    def detect_objects(self, image):
+        return self.detect([image])[0]
+
+    def annotate_objects(self, annotator, results):
+        annotate_objects(annotator, results, self.labels)
+
+
+@register_backend('tflite')
+class TFLiteBackend(Backend):
+    """SSD MobileNet on tflite_runtime through Detector"""
+    def __init__(self, model="detect.tflite", labels="coco_labels.txt", threshold=0.4, tiles=None,
+                 tile_overlap=0.2, tile_workers=1, num_threads=None, **options):
+        super().__init__(threshold, labels)
+        self.model = model
+        self.labels_path = labels
+        self.detector_options = dict(tiles=tiles, tile_overlap=tile_overlap,
+                                     tile_workers=tile_workers, num_threads=num_threads)
+        self.detector = None
+
+    def load(self):
+        self.detector = Detector(self.model, self.labels_path, self.threshold, **self.detector_options)
+
+    @property
+    def capture_size(self):
+        return self.detector.capture_size
+
+    def detect(self, batch):
+        return [self.detector.detect_objects(image) for image in batch]
+
+
+@register_backend('opencv')
+class OpenCVBackend(Backend):
+    """SSD MobileNetV3 on the OpenCV DNN module, run as batched blobs"""
+    OPENCV_PERSON_CLASS_ID = 1
+
+    def __init__(self, weights=os.path.join(OPENCV_MODEL_DIR, 'frozen_inference_graph.pb'),
+                 config=os.path.join(OPENCV_MODEL_DIR, 'ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt'),
+                 threshold=0.4, input_size=(320, 320), labels=None, **options):
+        super().__init__(threshold, labels)
+        self.weights = weights
+        self.config = config
+        self.input_size = input_size
+        self.net = None
+
+    def load(self):
+        import cv2
+        self._blob_from_images = cv2.dnn.blobFromImages
+        self.net = cv2.dnn.readNetFromTensorflow(self.weights, self.config)
+
+    @property
+    def capture_size(self):
+        return CAMERA_WIDTH, CAMERA_HEIGHT
+
+    def detect(self, batch):
+        # Frames are already RGB, so unlike the OpenCV examples no channel swap
+        with REGISTRY.time("preprocess"):
+            blob = self._blob_from_images(batch, scalefactor=1.0 / 127.5, size=self.input_size,
+                                          mean=(127.5, 127.5, 127.5), swapRB=False, crop=False)
+            self.net.setInput(blob)
+        with REGISTRY.time("invoke"):
+            # Rows are [image_id, class_id, confidence, xmin, ymin, xmax, ymax]
+            rows = self.net.forward().reshape(-1, 7)
+        with REGISTRY.time("postprocess"):
+            return self._split_rows(rows, len(batch))
+
+    def _split_rows(self, rows, batch_size):
+        rows = rows[(rows[:, 1] == self.OPENCV_PERSON_CLASS_ID) & (rows[:, 2] >= self.threshold)]
+        results = []
+        for image_id in range(batch_size):
+            hits = rows[rows[:, 0] == image_id]
+            result = np.empty(len(hits), dtype=DETECTION_DTYPE)
+            result['bounding_box'] = np.clip(hits[:, [4, 3, 6, 5]], 0, 1)
+            result['class_id'] = PERSON_CLASS_ID
+            result['score'] = hits[:, 2]
+            results.append(result)
+        return results
+
+
+def load_backend(names, warm_up=True, **options):
+    """
+    Loads the first backend in names that works on this board, falling back
+    to the next one when its runtime or model is missing. options are passed
+    to every backend, which ignore the ones they do not use.
+    """
+    errors = []
+    for name in names:
+        if name not in BACKENDS:
+            errors.append(f"{name}: unknown backend")
+            continue
+        try:
+            backend = BACKENDS[name](**options)
+            backend.load()
+            if warm_up:
+                backend.warm_up()
+        except Exception as err:
+            errors.append(f"{name}: {err!r}")
+            print(f"Backend {name} unavailable, trying the next one: {err!r}")
+            continue
+        return backend
+    raise RuntimeError("No inference backend could be loaded ({})".format("; ".join(errors)))
@@ -0,0 +1,103 @@
+"""
+Round-trip check and payload size comparison of the upload encodings.
+
+Usage: python bench_wire.py [--samples 20] [--interval 50] [--repeat 2000]
+
+Compares, for one batch of samples:
+  - the original per-sample POST body (img1..img5, mode and timestamp)
+  - the aggregator's per-sample POST body
+  - the /add/batch/ JSON body, plain and gzipped
+  - the binary encoding of wire.py
+Per-sample bodies are one HTTPS request each, batches a single request.
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import datetime
+
+import wire
+
+DEVICE_ID = "raspi-entrance-01"
+
+
+def make_samples(n, interval, start=None, seed=0):
+    """-> (list) n batch samples interval seconds apart with a wandering count"""
+    rng = random.Random(seed)
+    ts = int(start or time.time())
+    seq = int(time.time() * 1000)
+    count = 3
+    samples = []
+    for _ in range(n):
+        count = max(0, count + rng.choice((-1, 0, 0, 0, 1)))
+        samples.append({"seq": seq, "ts": ts, "number_ppl": count})
+        seq += 1
+        ts += interval + rng.randint(-2, 2)
+    return samples
+
+
+def legacy_body(sample):
+    counts = [max(0, sample["number_ppl"] + d) for d in (0, 1, 0, -1, 0)]
+    body = {f"img{i + 1}": c for i, c in enumerate(counts)}
+    body["mode"] = sample["number_ppl"]
+    body["timestamp"] = datetime.fromtimestamp(sample["ts"]).isoformat(sep=' ', timespec='microseconds')
+    return json.dumps(body).encode()
+
+
+def aggregator_body(sample):
+    return json.dumps({
+        "mode": float(sample["number_ppl"]),
+        "statistic": "median",
+        "samples": 5,
+        "timestamp": datetime.fromtimestamp(sample["ts"]).isoformat(sep=' ', timespec='seconds'),
+    }).encode()
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=20, help='Samples per batch')
+    parser.add_argument('--interval', type=int, default=50, help='Seconds between samples')
+    parser.add_argument('--repeat', type=int, default=2000, help='Timing iterations')
+    args = parser.parse_args()
+
+    samples = make_samples(args.samples, args.interval)
+    batch_json = json.dumps({"device": DEVICE_ID, "samples": samples}).encode()
+    batch_gzip = gzip.compress(batch_json)
+    binary = wire.encode(DEVICE_ID, samples)
+
+    device, decoded = wire.decode(binary)
+    assert device == DEVICE_ID and decoded == samples, "binary round trip does not match"
+    assert json.loads(gzip.decompress(batch_gzip))["samples"] == samples
+
+    rows = [
+        ("legacy JSON, per sample", sum(len(legacy_body(s)) for s in samples), len(samples)),
+        ("aggregator JSON, per sample", sum(len(aggregator_body(s)) for s in samples), len(samples)),
+        ("batch JSON", len(batch_json), 1),
+        ("batch JSON + gzip", len(batch_gzip), 1),
+        ("binary", len(binary), 1),
+    ]
+    print(f"{args.samples} samples, {args.interval}s apart")
+    print(f"{'encoding':<30}{'body bytes':>12}{'per sample':>12}{'requests':>10}")
+    for name, size, requests in rows:
+        print(f"{name:<30}{size:>12}{size / len(samples):>12.1f}{requests:>10}")
+
+    print(f"\n{'operation':<30}{'us per batch':>12}")
+    for name, fn in [
+        ("json encode + gzip", lambda: gzip.compress(json.dumps({"device": DEVICE_ID, "samples": samples}).encode())),
+        ("gunzip + json decode", lambda: json.loads(gzip.decompress(batch_gzip))),
+        ("binary encode", lambda: wire.encode(DEVICE_ID, samples)),
+        ("binary decode", lambda: wire.decode(binary)),
+    ]:
+        print(f"{name:<30}{timed(fn, args.repeat):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
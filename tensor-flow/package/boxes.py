@@ -0,0 +1,34 @@
+import numpy as np
+
+
+def area(boxes):
+    """boxes: (N, 4) [ymin, xmin, ymax, xmax] -> (N,) box areas"""
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def iou_matrix(a, b):
+    """a: (N, 4), b: (M, 4) boxes -> (N, M) pairwise intersection over union"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    overlap = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    union = area(a)[:, None] + area(b)[None, :] - overlap
+    return np.where(union > 0, overlap / np.maximum(union, 1e-9), 0.0)
+
+
+def centers(boxes):
+    """boxes: (N, 4) -> (N, 2) [y, x] centre points"""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return (boxes[:, :2] + boxes[:, 2:]) / 2
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.5):
+    """Greedy NMS -> indices of the boxes kept, highest score first"""
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    iou = iou_matrix(boxes[order], boxes[order])
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1:] &= iou[i, i + 1:] < iou_threshold
+    return order[keep]
@@ -1,77 +1,180 @@
-import io
+from time import monotonic
 
-from threading import Thread
-from picamera import PiCamera
-from PIL import Image
-from time import sleep, monotonic
-
-from data import Data
+from aggregator import Aggregator
+from data import Data, settings
+from debug_stream import DebugStream
 from detector import Detector
-from sig import button_press, button_interrupt
-from annotation import Annotator
+from metrics import REGISTRY, MetricsServer, MetricsLogger
+from motion import MotionGate
+from pipeline import Pipeline
+from scheduler import AdaptiveScheduler
+from startup import STARTUP, Watchdog
+from sources import FrameSource, PiCameraSource
+from tracker import Tracker
+from workers import InferencePool
+from spool import Spool
 
 CAMERA_WIDTH = 640
 CAMERA_HEIGHT = 480
 
 
-def start_background(detector:Detector):
-    """Start image detection in the background"""
-    data = Data()
-    with PiCamera(resolution=(CAMERA_WIDTH, CAMERA_HEIGHT)) as camera:
-        camera.vflip = False
-        camera.exposure_mode = 'sports'
-        camera.led = True
-        stream = io.BytesIO()
-        sleep(2)
-        while True:
-            try:
-                stream.truncate(0)
-                stream.seek(0)
-                camera.capture(stream, format='jpeg', resize=(detector.input_width, detector.input_height))
-                image = Image.open(stream)
-                data.detection_list = detector.detect_objects(image)
-                data.process_result()
-                sleep(10)
+def start_background(detector:Detector, camera_cls=None, capture_interval=10.0,
+                     inference_interval=0.0, upload_interval=1.0, motion_threshold=0.01,
+                     pool:InferencePool=None, aggregator:Aggregator=None, metrics_port=None,
+                     metrics_interval=60.0, scheduler:AdaptiveScheduler=None,
+                     source:FrameSource=None, max_speed=False, debug_port=None):
+    """
+    Start image detection in the background. With a pool, inference runs in
+    its worker processes and detector may be None. Stage timings are served
+    in the Prometheus format on metrics_port when given and printed every
+    metrics_interval seconds (0 disables the log line). A scheduler replaces
+    the fixed capture_interval.
+
+    Frames come from source, the Pi camera (built with camera_cls) unless
+    another is given. max_speed captures without any interval and never
+    drops a frame, for replaying recordings; a finite source ends the run
+    once its frames have been counted.
 
-            except KeyboardInterrupt:
-                break
+    With debug_port, annotated frames are served as MJPEG on that port
+    (http://<device>:<port>/) while a browser is watching.
+
+    systemd is told the service is ready once the source is open and the
+    pipeline running, and its watchdog is fed while every stage keeps
+    making progress.
+    """
+    source = source or PiCameraSource(camera_cls, resolution=(CAMERA_WIDTH, CAMERA_HEIGHT))
+    if max_speed:
+        capture_interval, scheduler = 0.0, None
+    capture_size = (pool or detector).capture_size
+    with STARTUP.phase("open"):
+        source.open(*capture_size)
+    with source:
+        # Samples are written to disk first and drained by the uploader so a
+        # network outage delays delivery instead of losing counts
+        data = Data(aggregator=aggregator)
+        spool = Spool(settings().SPOOL_PATH)
+        uploader = data.uploader(spool, idle_interval=upload_interval)
+        debug_stream = DebugStream(debug_port).start() if debug_port else None
+        pipeline = Pipeline(detector, source, data, capture_interval=capture_interval,
+                            inference_interval=inference_interval,
+                            upload_interval=0.0, sink=spool.put,
+                            motion_gate=MotionGate(motion_threshold) if motion_threshold else None,
+                            pool=pool, scheduler=scheduler, lossless=max_speed,
+                            debug_stream=debug_stream)
+        REGISTRY.gauge("spool_backlog", "Samples waiting in the spool.", lambda: len(spool))
+        # With a pool, frames are dropped at submission and the frames queue goes unused
+        REGISTRY.gauge("dropped_frames", "Frames dropped by backpressure.",
+                       lambda: pool.dropped if pool is not None else pipeline.frames.dropped)
+        REGISTRY.gauge("upload_failures", "Failed upload attempts.", lambda: uploader.failures)
+        if scheduler is not None:
+            REGISTRY.gauge("capture_interval_seconds", "Current capture interval.", lambda: scheduler.interval)
+        server = MetricsServer(REGISTRY, metrics_port).start() if metrics_port else None
+        logger = MetricsLogger(REGISTRY, metrics_interval) if metrics_interval else None
+        if logger is not None:
+            logger.start()
+        uploader.start()
+        pipeline.start()
+        STARTUP.ready()
+        # The capture stage legitimately sits out a whole interval between steps
+        stall = 60.0 + (scheduler.max_interval if scheduler is not None else capture_interval)
+        watchdog = Watchdog(lambda: pipeline.healthy(stall)).start()
+        try:
+            pipeline.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watchdog.stop()
+            pipeline.stop()
+            if pool is not None:
+                pool.close()
+            uploader.stop()
+            if uploader.is_alive():
+                # Closing under a send would lose the ack of samples the server
+                # already took, leave them to the process exit instead
+                print("Uploader still sending, leaving the spool open")
+            else:
+                spool.close()
+            if server is not None:
+                server.stop()
+            if logger is not None:
+                logger.stop()
+            if debug_stream is not None:
+                debug_stream.stop()
+            print(pipeline.stats())
+            print("metrics: " + REGISTRY.summary())
 
         print("Exitting")
 
 
-def watch_background(detector:Detector):
-    """Start image detection with preview"""
-    data = Data()
-    t = Thread(target=data.timer_thread)
-    with PiCamera(resolution=(CAMERA_WIDTH, CAMERA_HEIGHT), framerate=30) as camera:
-        camera.vflip = False
-        sleep(2)
-        camera.exposure_mode='sports'
-        camera.start_preview()
-        sleep(2)
-        t.start()
-        stream = io.BytesIO()
-        annotator = Annotator(camera, "green")
-        while True:
-            try:
-                for _ in camera.capture_continuous(stream, format='jpeg',
-                                                   resize=(detector.input_width, detector.input_height)):
-                    stream.seek(0)
-                    image = Image.open(stream).convert('RGB')
-                    start_time = monotonic()
-                    data.results = detector.detect_objects(image)
-                    elapsed_ms = (monotonic() - start_time) * 1000
+def watch_background(detector:Detector, camera_cls=None, motion_threshold=0.01,
+                     detect_every=1, count_line=None, source:FrameSource=None, debug_port=None):
+    """
+    Start image detection with preview. The detector runs on every
+    detect_every-th frame (or sooner once the tracks lose confidence) and
+    the tracker carries the boxes in between. Sources without a Pi camera
+    have no preview to draw on and print the count once a second instead,
+    or stream the annotated frames as MJPEG on debug_port.
+
+    Like start_background, systemd is told the service is ready once the
+    source is open and its watchdog is fed while frames keep coming.
+    """
+    source = source or PiCameraSource(camera_cls, resolution=(CAMERA_WIDTH, CAMERA_HEIGHT))
+    with STARTUP.phase("open"):
+        source.open(*detector.capture_size)
+    with source:
+        camera = source.camera
+        annotator = None
+        if camera is not None:
+            # PIL is only needed for the preview overlay
+            from annotation import Annotator
+            camera.start_preview()
+            annotator = Annotator(camera, "green")
+        debug_stream = DebugStream(debug_port).start() if debug_port else None
+        gate = MotionGate(motion_threshold) if motion_threshold else None
+        tracker = Tracker(line=count_line)
+        last_print = 0.0
+        last_frame = monotonic()
+        STARTUP.ready()
+        watchdog = Watchdog(lambda: monotonic() - last_frame < 60.0).start()
+        try:
+            for frame_index, image in enumerate(source.capture_continuous()):
+                start_time = last_frame = monotonic()
+                if frame_index % detect_every == 0 or tracker.needs_detection():
+                    if gate is not None:
+                        detections = gate.detect(detector, image)
+                    else:
+                        detections = detector.detect_objects(image)
+                    results = tracker.update(detections)
+                else:
+                    results = tracker.predict()
+                elapsed_ms = (monotonic() - start_time) * 1000
 
-                    annotator.clear()
-                    detector.annotate_objects(annotator, data.results)
-                    annotator.text([5, 0], '%.1fms' % (elapsed_ms))
-                    annotator.text([540, 0], f"Person count: {len(data.results)}")
-                    annotator.update()
-                    stream.seek(0)
-            except KeyboardInterrupt:
-                break
-            finally:
-                data.flag = False
-                t.join()
+                if debug_stream is not None:
+                    debug_stream.publish(image, results,
+                                         ['%.1fms' % elapsed_ms, f"Person count: {len(results)}"])
+                if annotator is None:
+                    if debug_stream is not None:
+                        continue
+                    if start_time - last_print >= 1.0:
+                        last_print = start_time
+                        print(f"frame {frame_index}: {len(results)} people, {elapsed_ms:.1f}ms")
+                    continue
+                annotator.clear()
+                detector.annotate_objects(annotator, results)
+                # The timing differs every frame, it alone never forces a redraw
+                annotator.text([5, 0], '%.1fms' % (elapsed_ms), volatile=True)
+                annotator.text([540, 0], f"Person count: {len(results)}")
+                if gate is not None:
+                    annotator.text([5, 12], 'skipped %.0f%%' % (gate.skip_ratio * 100))
+                if count_line is not None:
+                    annotator.text([540, 12], f"In: {tracker.entries} Out: {tracker.exits}")
+                annotator.update()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watchdog.stop()
+            if camera is not None:
                 camera.stop_preview()
-                print("Quitting\n")
+            if debug_stream is not None:
+                debug_stream.stop()
+            print("Quitting\n")
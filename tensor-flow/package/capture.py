@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def _round_up(value, n):
+    """Rounds value up to the next multiple of n"""
+    return n * ((value + (n - 1)) // n)
+
+
+class RGBCapture(object):
+    """Captures unencoded RGB frames from the camera into one reusable buffer"""
+    def __init__(self, camera, width, height, use_video_port=False):
+        self.camera = camera
+        self.width = width
+        self.height = height
+        self.use_video_port = use_video_port
+        # The rgb encoder pads each row up to a multiple of 32 pixels and the
+        # frame height up to a multiple of 16, so capture into a padded buffer
+        # and hand out a view of the visible region
+        self.buffer = np.empty((_round_up(height, 16), _round_up(width, 32), 3), dtype=np.uint8)
+        self.frame = self.buffer[:height, :width]
+
+    def capture(self):
+        """Captures a single frame, returns a view that is overwritten by the next capture"""
+        self.camera.capture(self.buffer, format='rgb', resize=(self.width, self.height),
+                            use_video_port=self.use_video_port)
+        return self.frame
+
+    def capture_continuous(self):
+        """Yields the same frame view, refreshed with every new capture"""
+        for _ in self.camera.capture_continuous(self.buffer, format='rgb',
+                                                resize=(self.width, self.height),
+                                                use_video_port=self.use_video_port):
+            yield self.frame
@@ -1,55 +1,92 @@
 import os
-import requests
-from requests.auth import HTTPBasicAuth
+import socket
+from collections import namedtuple
 from time import sleep
-from datetime import datetime
-from dotenv import load_dotenv
 
-load_dotenv()
-ROUTE = os.environ["POST_DATA_ROUTE"]
-USER = os.environ["USER"]
-PASSWORD = os.environ["PASSWORD"]
+from aggregator import Aggregator
+from metrics import REGISTRY
+from spool import Spool, Uploader
+
+Settings = namedtuple('Settings', ['ROUTE', 'USER', 'PASSWORD', 'BATCH_ROUTE', 'DEVICE_ID',
+                                   'SPOOL_PATH', 'WIRE_FORMAT'])
+_settings = None
+
+
+def settings():
+    """
+    Reads .env and the environment on first use rather than at import, so
+    the startup path does not pay for dotenv until a Data is made
+    """
+    global _settings
+    if _settings is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _settings = Settings(
+            ROUTE=os.environ["POST_DATA_ROUTE"],
+            USER=os.environ["USER"],
+            PASSWORD=os.environ["PASSWORD"],
+            # Optional /add/batch/ endpoint taking many samples per request, used by the spool uploader
+            BATCH_ROUTE=os.environ.get("POST_BATCH_ROUTE"),
+            DEVICE_ID=os.environ.get("DEVICE_ID", socket.gethostname()),
+            SPOOL_PATH=os.environ.get("SPOOL_PATH", "spool.db"),
+            # json or binary (see wire.py), the encoding of batches sent to POST_BATCH_ROUTE
+            WIRE_FORMAT=os.environ.get("WIRE_FORMAT", "json"))
+    return _settings
+
+
+def __getattr__(name):
+    # data.ROUTE and friends keep working, read on first access
+    if name in Settings._fields:
+        return getattr(settings(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Data(object):
     """Class for handling data sending/preprocessing"""
-    def __init__(self, collection_limit=5):
+    def __init__(self, collection_limit=5, aggregator:Aggregator=None):
         self.collection_limit = collection_limit
-        self.current_collection_count = 0
-        self.data = dict()
+        self.aggregator = aggregator or Aggregator('median', window=collection_limit)
         self.detection_list = []
         self.post_data_semaphore = True
+        import requests
+        self.settings = settings()
+        self.session = requests.Session()
+        self.session.auth = (self.settings.USER, self.settings.PASSWORD)
 
-    @property
-    def mode_index(self):
-        """return the mode index of the collection_limit"""
-        return self.collection_limit//2
+    def aggregate(self, timestamp=None):
+        """
+        Adds the latest detections to the aggregator, stamped with timestamp
+        (now when None), returns the sample to upload or None
+        """
+        sample = self.aggregator.add(len(self.detection_list), timestamp)
+        if sample is not None:
+            print(sample)
+        return sample
 
     def process_result(self):
         """Processing routine called everytime image data comes in"""
-        if self.current_collection_count < 5:
-            self.current_collection_count += 1
-            self.data[f'img{self.current_collection_count}'] = len(self.detection_list)
-            print(self.data)
-        else:
-            self.current_collection_count = 0
-            self.data['mode'] = sorted([value for value in self.data.values()])[self.mode_index]
-            self.data['timestamp'] = datetime.now().isoformat(sep=' ', timespec='seconds')
-            print(self.data)
-            self.post_data()
-
-    def post_data(self):
-        """Send data to the server"""
+        sample = self.aggregate()
+        if sample is not None:
+            self.post_data(sample)
+            sleep(1)
+
+    def post_data(self, sample):
+        """Send data to the server, returns whether it was accepted"""
         try:
-            r = requests.post(ROUTE, json=self.data, verify=True, timeout=2, auth=HTTPBasicAuth(USER, PASSWORD))
-            r.raise_for_status()
-            pass
+            with REGISTRY.time("upload"):
+                r = self.session.post(self.settings.ROUTE, json=sample, verify=True, timeout=2)
+                r.raise_for_status()
+            return True
         except Exception as err:
             print("Could not send data\n")
             print(err)
-        finally:
-            self.data.clear()
-            sleep(1)
+            return False
+
+    def uploader(self, spool:Spool, **options):
+        """Returns an Uploader draining spool to the configured routes"""
+        config = self.settings
+        return Uploader(spool, config.ROUTE, batch_route=config.BATCH_ROUTE, device_id=config.DEVICE_ID,
+                        wire_format=config.WIRE_FORMAT, auth=(config.USER, config.PASSWORD), **options)
 
     def timer_thread(self, time_interval):
         """Signal post event to run.py"""
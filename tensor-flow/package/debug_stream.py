@@ -0,0 +1,200 @@
+import io
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Condition, Event, Lock
+from time import monotonic
+
+import numpy as np
+
+BOUNDARY = b'frame'
+PAGE = b"""<html><head><title>Person counter</title></head>
+<body style="margin:0;background:#000"><img src="/stream" style="width:100%"></body></html>"""
+
+
+class DebugStream(object):
+    """
+    Annotated frames served as MJPEG at /stream (and /snapshot.jpg) for
+    watching a headless device from a browser.
+
+    publish() is called from the detection loop and returns straight away
+    while nobody is watching or the last frame was taken less than
+    1 / max_fps ago. Otherwise it copies the frame and wakes the encoder
+    thread, which draws the boxes into a reused canvas and JPEG encodes it
+    once for every connected client.
+    """
+    def __init__(self, port=8081, host="0.0.0.0", max_fps=5.0, quality=70, color=(0, 255, 0)):
+        self.max_fps = max_fps
+        self.quality = quality
+        self.color = np.array(color, dtype=np.uint8)
+        self.clients = 0
+        self.clients_lock = Lock()
+        self.last_publish = 0.0
+        self.canvas = None
+        self.pending = None
+        self.pending_ready = Condition()
+        self.jpeg = None
+        self.jpeg_seq = 0
+        self.jpeg_ready = Condition()
+        self.encoded = 0
+        self.stop_event = Event()
+        self.encoder = Thread(target=self._encode_loop, name="debug-encoder", daemon=True)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.server = Thread(target=self.httpd.serve_forever, name="debug-http", daemon=True)
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def watching(self):
+        """Whether a browser is connected, frames are only worth keeping for publish() then"""
+        return self.clients > 0
+
+    def start(self):
+        self.encoder.start()
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        with self.pending_ready:
+            self.pending_ready.notify_all()
+        with self.jpeg_ready:
+            self.jpeg_ready.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.encoder.join(5.0)
+
+    def publish(self, frame, results, lines=()):
+        """Offers a frame and its DETECTION_DTYPE results (frame relative boxes) to the viewers"""
+        if not self.clients:
+            return False
+        now = monotonic()
+        if now - self.last_publish < 1 / self.max_fps:
+            return False
+        self.last_publish = now
+        with self.pending_ready:
+            # Capture buffers are reused, so take a copy; an unencoded
+            # older frame is simply replaced
+            self.pending = (np.array(frame, copy=True), np.array(results, copy=True), list(lines))
+            self.pending_ready.notify()
+        return True
+
+    def _draw_boxes(self, canvas, results, thickness=2):
+        height, width = canvas.shape[:2]
+        scale = np.array([height, width, height, width], dtype=np.float32)
+        for ymin, xmin, ymax, xmax in (results['bounding_box'] * scale).astype(np.int32).tolist():
+            ymin, ymax = max(ymin, 0), min(ymax, height)
+            xmin, xmax = max(xmin, 0), min(xmax, width)
+            if ymax <= ymin or xmax <= xmin:
+                continue
+            canvas[ymin:ymin + thickness, xmin:xmax] = self.color
+            canvas[max(ymax - thickness, ymin):ymax, xmin:xmax] = self.color
+            canvas[ymin:ymax, xmin:xmin + thickness] = self.color
+            canvas[ymin:ymax, max(xmax - thickness, xmin):xmax] = self.color
+
+    def _render(self, frame, results, lines):
+        from PIL import Image, ImageDraw
+        if self.canvas is None or self.canvas.shape != frame.shape:
+            self.canvas = np.empty_like(frame)
+            self.output = io.BytesIO()
+        np.copyto(self.canvas, frame)
+        self._draw_boxes(self.canvas, results)
+        image = Image.fromarray(self.canvas)
+        if lines or len(results):
+            draw = ImageDraw.Draw(image)
+            height, width = frame.shape[:2]
+            for (ymin, xmin, _, _), score in zip(results['bounding_box'].tolist(), results['score'].tolist()):
+                draw.text((xmin * width + 3, ymin * height + 2), '%.2f' % score, fill=tuple(self.color.tolist()))
+            for row, line in enumerate(lines):
+                draw.text((5, 2 + row * 12), line, fill=tuple(self.color.tolist()))
+        self.output.seek(0)
+        self.output.truncate()
+        image.save(self.output, format='JPEG', quality=self.quality)
+        return self.output.getvalue()
+
+    def _encode_loop(self):
+        while not self.stop_event.is_set():
+            with self.pending_ready:
+                while self.pending is None and not self.stop_event.is_set():
+                    self.pending_ready.wait()
+                item, self.pending = self.pending, None
+            if item is None:
+                continue
+            try:
+                jpeg = self._render(*item)
+            except Exception as err:
+                print(f"Debug stream could not encode a frame: {err}")
+                continue
+            self.encoded += 1
+            with self.jpeg_ready:
+                self.jpeg = jpeg
+                self.jpeg_seq += 1
+                self.jpeg_ready.notify_all()
+
+    def _next_jpeg(self, seen, timeout=5.0):
+        """Waits for a frame newer than seen -> (seq, jpeg) or (seen, None) on timeout"""
+        with self.jpeg_ready:
+            self.jpeg_ready.wait_for(lambda: self.jpeg_seq != seen or self.stop_event.is_set(), timeout)
+            if self.jpeg_seq == seen:
+                return seen, None
+            return self.jpeg_seq, self.jpeg
+
+    def _handler(self):
+        stream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, content_type, body):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/":
+                    self._send("text/html", PAGE)
+                elif path == "/snapshot.jpg":
+                    with stream.clients_lock:
+                        stream.clients += 1
+                    try:
+                        # Skip the JPEG encoded before this client connected
+                        _, jpeg = stream._next_jpeg(stream.jpeg_seq)
+                    finally:
+                        with stream.clients_lock:
+                            stream.clients -= 1
+                    if jpeg is None:
+                        self.send_error(503, "No frame yet")
+                    else:
+                        self._send("image/jpeg", jpeg)
+                elif path == "/stream":
+                    self._stream()
+                else:
+                    self.send_error(404)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=" + BOUNDARY.decode())
+                self.end_headers()
+                with stream.clients_lock:
+                    stream.clients += 1
+                try:
+                    seen = stream.jpeg_seq
+                    while not stream.stop_event.is_set():
+                        seen, jpeg = stream._next_jpeg(seen)
+                        if jpeg is None:
+                            continue
+                        self.wfile.write(b"--" + BOUNDARY + b"\r\nContent-Type: image/jpeg\r\nContent-Length: " +
+                                         str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with stream.clients_lock:
+                        stream.clients -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
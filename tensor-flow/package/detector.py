@@ -1,21 +1,80 @@
 import os
 import re
 import numpy as np
-from tflite_runtime.interpreter import Interpreter
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
+from boxes import non_max_suppression
+from metrics import REGISTRY
 
 CAMERA_WIDTH = 640
 CAMERA_HEIGHT = 480
+PERSON_CLASS_ID = 0
 
+# Compact per-detection record shared by annotate_objects and Data
+DETECTION_DTYPE = np.dtype([
+    ('bounding_box', np.float32, (4,)),
+    ('class_id', np.int32),
+    ('score', np.float32),
+])
 
-class Detector(object):
-    """Detector class which acts as a wrapper for the tensor flow library API"""
-    def __init__(self, model, path_to_label_file, threshold=0.4):
-        self.interpreter = Interpreter(model)
+
+class _InterpreterSlot(object):
+    """One interpreter with its tensor accessors resolved up front"""
+    __slots__ = ('interpreter', 'input', 'boxes', 'classes', 'scores', 'count')
+
+    def __init__(self, model, num_threads=None):
+        # Imported here so boards without tflite can still use the other backends
+        from tflite_runtime.interpreter import Interpreter
+        self.interpreter = Interpreter(model, num_threads=num_threads)
         self.interpreter.allocate_tensors()
+        # Calling an accessor returns a view into the interpreter's memory
+        # without going through the details dicts again
+        self.input = self.interpreter.tensor(self.interpreter.get_input_details()[0]['index'])
+        output_indices = [d['index'] for d in self.interpreter.get_output_details()]
+        self.boxes, self.classes, self.scores, self.count = (
+            self.interpreter.tensor(index) for index in output_indices[:4])
+
+
+class Detector(object):
+    """
+    Detector class which acts as a wrapper for the tensor flow library API.
+
+    With tiles=(rows, cols) the frame is cut into overlapping tiles (plus a
+    downscaled copy of the whole frame) that run through a pool of
+    tile_workers interpreters in parallel, and the boxes are merged with
+    non-maximum suppression. Feed it frames at capture_size.
+
+    num_threads is passed on to every interpreter, None leaves the choice to
+    tflite.
+    """
+    def __init__(self, model, path_to_label_file, threshold=0.4, tiles=None, tile_overlap=0.2,
+                 tile_workers=1, nms_threshold=0.5, full_frame=True, num_threads=None):
+        self._slot = _InterpreterSlot(model, num_threads)
+        self.interpreter = self._slot.interpreter
         self.labels = self.load_labels(path_to_label_file)
         self.threshold = threshold
         _, self.input_height, self.input_width, _ = self.interpreter.get_input_details()[0]['shape']
-	
+
+        self.tiles = tiles
+        self.tile_overlap = tile_overlap
+        self.nms_threshold = nms_threshold
+        self.full_frame = full_frame
+        self._layouts = {}
+        if tiles is not None:
+            self._slots = Queue()
+            self._slots.put(self._slot)
+            for _ in range(tile_workers - 1):
+                self._slots.put(_InterpreterSlot(model, num_threads))
+            self._pool = ThreadPoolExecutor(max_workers=tile_workers, thread_name_prefix="tile")
+
+    @property
+    def capture_size(self):
+        """(width, height) frames should be captured at"""
+        if self.tiles is None:
+            return self.input_width, self.input_height
+        return CAMERA_WIDTH, CAMERA_HEIGHT
+
     @staticmethod
     def load_labels(path):
         """Loads the labels file. Supports files with or without index numbers."""
@@ -32,9 +91,7 @@ class Detector(object):
 
     def set_input_tensor(self, image):
         """Sets the input tensor."""
-        tensor_index = self.interpreter.get_input_details()[0]['index']
-        input_tensor = self.interpreter.tensor(tensor_index)()[0]
-        input_tensor[:, :] = image
+        self._slot.input()[0][:, :] = image
 
     def get_output_tensor(self, index):
         """Returns the output tensor at the given index."""
@@ -42,40 +99,101 @@ class Detector(object):
         tensor = np.squeeze(self.interpreter.get_tensor(output_details['index']))
         return tensor
 
+    def _filtered_results(self, slot):
+        """Collects the thresholded people from the slot's last invoke"""
+        # Views must not outlive this call, invoke() refuses to run while
+        # references into the interpreter's buffers are still held
+        count = int(slot.count()[0])
+        scores = slot.scores()[0, :count]
+        classes = slot.classes()[0, :count]
+        keep = np.flatnonzero((scores >= self.threshold) & (classes == PERSON_CLASS_ID))
+
+        results = np.empty(len(keep), dtype=DETECTION_DTYPE)
+        results['bounding_box'] = slot.boxes()[0, keep]
+        results['class_id'] = classes[keep]
+        results['score'] = scores[keep]
+        return results
+
     def detect_objects(self, image):
-        """Returns a list of detection results, each a dictionary of object info."""
-        self.set_input_tensor(image)
-        self.interpreter.invoke()
-
-        # Get all output details
-        boxes = self.get_output_tensor(0)
-        classes = self.get_output_tensor(1)
-        scores = self.get_output_tensor(2)
-        count = int(self.get_output_tensor(3))
-
-        results = []
-        for i in range(count):
-            if scores[i] >= self.threshold and classes[i] == 0:
-                result = {
-                    'bounding_box': boxes[i],
-                    'class_id': classes[i],
-                    'score': scores[i]
-                }
-                results.append(result)
+        """Returns a DETECTION_DTYPE structured array of the people found in the image."""
+        if self.tiles is not None:
+            return self.detect_tiled(image)
+        with REGISTRY.time("preprocess"):
+            self.set_input_tensor(image)
+        with REGISTRY.time("invoke"):
+            self.interpreter.invoke()
+        with REGISTRY.time("postprocess"):
+            return self._filtered_results(self._slot)
+
+    def _tile_layout(self, height, width):
+        """
+        Returns (y0, x0, y1, x1, row_index, col_index) for every tile of a
+        height x width frame, the index arrays resample the tile to the model
+        input size by nearest neighbour
+        """
+        key = (height, width)
+        if key not in self._layouts:
+            rows, cols = self.tiles
+            step = 1 - self.tile_overlap
+            tile_h = int(round(height / (1 + (rows - 1) * step)))
+            tile_w = int(round(width / (1 + (cols - 1) * step)))
+            windows = [(min(int(r * tile_h * step), height - tile_h),
+                        min(int(c * tile_w * step), width - tile_w))
+                       for r in range(rows) for c in range(cols)]
+            windows = [(y0, x0, y0 + tile_h, x0 + tile_w) for y0, x0 in windows]
+            if self.full_frame:
+                windows.append((0, 0, height, width))
+            layout = []
+            for y0, x0, y1, x1 in windows:
+                row_index = y0 + np.arange(self.input_height) * (y1 - y0) // self.input_height
+                col_index = x0 + np.arange(self.input_width) * (x1 - x0) // self.input_width
+                layout.append((y0, x0, y1, x1, row_index[:, None], col_index))
+            self._layouts[key] = layout
+        return self._layouts[key]
+
+    def _detect_tile(self, frame, tile):
+        y0, x0, y1, x1, row_index, col_index = tile
+        slot = self._slots.get()
+        try:
+            with REGISTRY.time("preprocess"):
+                slot.input()[0][:, :] = frame[row_index, col_index]
+            with REGISTRY.time("invoke"):
+                slot.interpreter.invoke()
+            with REGISTRY.time("postprocess"):
+                results = self._filtered_results(slot)
+        finally:
+            self._slots.put(slot)
+        # Map tile relative boxes back to frame relative coordinates
+        height, width = frame.shape[:2]
+        scale = np.array([y1 - y0, x1 - x0, y1 - y0, x1 - x0], dtype=np.float32)
+        offset = np.array([y0, x0, y0, x0], dtype=np.float32)
+        size = np.array([height, width, height, width], dtype=np.float32)
+        results['bounding_box'] = (results['bounding_box'] * scale + offset) / size
         return results
 
+    def detect_tiled(self, image):
+        """Runs every tile through the interpreter pool and merges the boxes"""
+        frame = np.asarray(image)
+        layout = self._tile_layout(*frame.shape[:2])
+        results = np.concatenate(list(self._pool.map(lambda tile: self._detect_tile(frame, tile), layout)))
+        with REGISTRY.time("merge"):
+            keep = non_max_suppression(results['bounding_box'], results['score'], self.nms_threshold)
+            return results[keep]
+
     def annotate_objects(self, annotator, results):
         """Draws the bounding box and label for each object in the results."""
-        for obj in results:
-            # Convert the bounding box figures from relative coordinates
-            # to absolute coordinates based on the original resolution
-            ymin, xmin, ymax, xmax = obj['bounding_box']
-            xmin = int(xmin * CAMERA_WIDTH)
-            xmax = int(xmax * CAMERA_WIDTH)
-            ymin = int(ymin * CAMERA_HEIGHT)
-            ymax = int(ymax * CAMERA_HEIGHT)
-
-            # Overlay the box, label, and score on the camera preview
-            annotator.bounding_box([xmin, ymin, xmax, ymax])
-            annotator.text([xmin, ymin],
-                           '%s\n%.2f' % (self.labels[obj['class_id']], obj['score']))
+        annotate_objects(annotator, results, self.labels)
+
+
+def annotate_objects(annotator, results, labels):
+    """Draws DETECTION_DTYPE results onto the annotator using the given label map."""
+    # Convert the bounding box figures from relative coordinates
+    # to absolute coordinates based on the original resolution
+    scale = np.array([CAMERA_HEIGHT, CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_WIDTH], dtype=np.float32)
+    absolute_boxes = (results['bounding_box'] * scale).astype(np.int32)
+    for (ymin, xmin, ymax, xmax), class_id, score in zip(absolute_boxes.tolist(),
+                                                         results['class_id'].tolist(),
+                                                         results['score'].tolist()):
+        # Overlay the box, label, and score on the camera preview
+        annotator.bounding_box([xmin, ymin, xmax, ymax])
+        annotator.text([xmin, ymin], '%s\n%.2f' % (labels[class_id], score))
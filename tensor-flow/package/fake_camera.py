@@ -0,0 +1,112 @@
+import io
+import numpy as np
+from time import sleep
+
+from capture import _round_up
+
+
+class FakeOverlay(object):
+    """Stand-in for picamera.PiRenderer overlays"""
+    def __init__(self, source, size):
+        self.size = size
+        self.source = source
+
+    def update(self, source):
+        self.source = source
+
+
+class FakeCamera(object):
+    """
+    Minimal picamera.PiCamera replacement for running the capture loops off
+    the Pi. Frames come from the given iterable of HxWx3 uint8 arrays, or a
+    synthetic box moving across a grey background when none are given.
+    """
+    def __init__(self, resolution=(640, 480), framerate=30, frames=None, frame_limit=None):
+        self.resolution = resolution
+        self.framerate = framerate
+        self.vflip = False
+        self.exposure_mode = 'auto'
+        self.led = False
+        self.previewing = False
+        self.closed = False
+        self.frame_count = 0
+        self.frame_limit = frame_limit
+        self._frames = iter(frames) if frames is not None else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.closed = True
+
+    def start_preview(self):
+        self.previewing = True
+
+    def stop_preview(self):
+        self.previewing = False
+
+    def add_overlay(self, source, size=None, **options):
+        return FakeOverlay(source, size)
+
+    def remove_overlay(self, overlay):
+        pass
+
+    def _synthetic_frame(self, width, height):
+        """Grey frame with a bright box that moves a few pixels each frame"""
+        frame = np.full((height, width, 3), 96, dtype=np.uint8)
+        box_w, box_h = max(width // 8, 1), max(height // 3, 1)
+        x = (self.frame_count * 4) % max(width - box_w, 1)
+        y = (height - box_h) // 2
+        frame[y:y + box_h, x:x + box_w] = 220
+        return frame
+
+    def _next_frame(self, resize):
+        width, height = resize or self.resolution
+        if self.frame_limit is not None and self.frame_count >= self.frame_limit:
+            raise EOFError("Fake camera ran out of frames")
+        if self._frames is None:
+            frame = self._synthetic_frame(width, height)
+        else:
+            frame = next(self._frames, None)
+            if frame is None:
+                raise EOFError("Fake camera ran out of frames")
+            if frame.shape[:2] != (height, width):
+                # Nearest neighbour resize, the real camera resizes on the GPU
+                rows = np.arange(height) * frame.shape[0] // height
+                cols = np.arange(width) * frame.shape[1] // width
+                frame = frame[rows[:, None], cols]
+        self.frame_count += 1
+        return frame
+
+    def capture(self, output, format='jpeg', resize=None, use_video_port=False):
+        """Writes one frame to output, an array/buffer for 'rgb' or a stream for 'jpeg'"""
+        frame = self._next_frame(resize)
+        height, width = frame.shape[:2]
+        if format == 'rgb':
+            padded = np.zeros((_round_up(height, 16), _round_up(width, 32), 3), dtype=np.uint8)
+            padded[:height, :width] = frame
+            if isinstance(output, np.ndarray):
+                output.reshape(padded.shape)[...] = padded
+            else:
+                output.write(padded.tobytes())
+        elif format == 'jpeg':
+            from PIL import Image
+            Image.fromarray(frame).save(output, format='JPEG')
+        else:
+            raise ValueError("Unsupported format: {}".format(format))
+
+    def capture_continuous(self, output, format='jpeg', resize=None, use_video_port=False):
+        """Yields output after every captured frame until the frames run out"""
+        while True:
+            if isinstance(output, io.IOBase):
+                output.seek(0)
+                output.truncate()
+            try:
+                self.capture(output, format=format, resize=resize, use_video_port=use_video_port)
+            except EOFError:
+                return
+            yield output
+            sleep(1 / self.framerate)
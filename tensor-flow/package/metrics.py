@@ -0,0 +1,182 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Event, Lock
+from time import perf_counter
+
+# Upper bounds in seconds, doubling from 100us to ~105s
+BUCKETS = tuple(0.0001 * 2 ** i for i in range(21))
+
+
+class Histogram(object):
+    """
+    Fixed bucket latency histogram. Observing is a bisect and two additions
+    under a lock, percentiles are interpolated within the bucket they fall in
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, p):
+        """p:(number) 0-100 -> (float) estimated seconds, None when empty"""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+            largest = self.max
+        if total == 0:
+            return None
+        rank = total * p / 100
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                low = self.buckets[index - 1] if index else 0.0
+                high = self.buckets[index] if index < len(self.buckets) else largest
+                return min(low + (high - low) * (rank - seen) / count, largest)
+            seen += count
+        return largest
+
+
+class _Timer(object):
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # Failed calls would skew the timings, they show up in the stage errors
+        if exc_type is None:
+            self.histogram.observe(perf_counter() - self.started)
+
+
+class Registry(object):
+    """
+    Per-stage latency histograms plus gauges read from callbacks, rendered
+    in the Prometheus text format or as a one line summary
+    """
+    def __init__(self, prefix="person_counter"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.gauges = {}
+        self.lock = Lock()
+
+    def histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        return histogram
+
+    def time(self, stage):
+        """Context manager recording the time spent in the block under stage"""
+        return _Timer(self.histogram(stage))
+
+    def observe(self, stage, seconds):
+        self.histogram(stage).observe(seconds)
+
+    def gauge(self, name, help, read):
+        """Registers a gauge whose value is read() at render time"""
+        self.gauges[name] = (help, read)
+
+    def render(self):
+        """-> (str) all metrics in the Prometheus text exposition format"""
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {name} Time spent in each processing stage.", f"# TYPE {name} histogram"]
+        for stage, histogram in sorted(self.histograms.items()):
+            with histogram.lock:
+                counts = list(histogram.counts)
+                total, seconds = histogram.count, histogram.sum
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {total}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {seconds:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {total}')
+        for gauge, (help, read) in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines += [f"# HELP {self.prefix}_{gauge} {help}", f"# TYPE {self.prefix}_{gauge} gauge",
+                      f"{self.prefix}_{gauge} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """-> (str) p50/p99 and count of every stage on one line"""
+        parts = []
+        for stage, histogram in sorted(self.histograms.items()):
+            if histogram.count:
+                parts.append("%s p50=%.1fms p99=%.1fms n=%d" % (
+                    stage, histogram.percentile(50) * 1000, histogram.percentile(99) * 1000, histogram.count))
+        return " | ".join(parts) or "no samples"
+
+
+# Shared by every module of the process, worker processes have their own
+REGISTRY = Registry()
+
+
+class MetricsServer(object):
+    """Serves registry.render() at /metrics on a background thread"""
+    def __init__(self, registry=REGISTRY, port=9108, host="0.0.0.0"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MetricsLogger(Thread):
+    """Prints registry.summary() every interval seconds"""
+    def __init__(self, registry=REGISTRY, interval=60.0):
+        super().__init__(name="metrics-log", daemon=True)
+        self.registry = registry
+        self.interval = interval
+        self.stop_event = Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            print("metrics: " + self.registry.summary())
+
+    def stop(self):
+        self.stop_event.set()
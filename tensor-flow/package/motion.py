@@ -0,0 +1,73 @@
+import numpy as np
+
+# ITU-R BT.601 luma weights
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+class MotionGate(object):
+    """
+    Cheap pre-filter in front of the detector. Each frame is downsampled to
+    grayscale and compared against a running average background; while the
+    fraction of changed pixels stays below threshold the previous detection
+    result is reused instead of invoking the model.
+    """
+    def __init__(self, threshold=0.01, pixel_delta=25, downsample=8, learning_rate=0.05,
+                 max_skips=30):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.downsample = downsample
+        self.learning_rate = learning_rate
+        self.max_skips = max_skips
+        self.background = None
+        self.last_result = None
+        self.last_change = 0.0
+        self.consecutive_skips = 0
+        self.hits = 0
+        self.skips = 0
+
+    def _gray(self, frame):
+        small = np.asarray(frame)[::self.downsample, ::self.downsample]
+        return small.astype(np.float32) @ LUMA
+
+    def changed(self, frame):
+        """Updates the background model, returns whether the frame needs inference"""
+        gray = self._gray(frame)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            self.last_change = 1.0
+            return True
+        diff = np.abs(gray - self.background)
+        self.last_change = float(np.count_nonzero(diff > self.pixel_delta)) / diff.size
+        self.background += self.learning_rate * (gray - self.background)
+        return self.last_change >= self.threshold
+
+    def needs_detection(self, frame):
+        """
+        Whether frame has to go through the detector, counted as a hit or a
+        skip. Callers running the detector elsewhere (e.g. an inference pool)
+        store its result in last_result
+        """
+        moved = self.changed(frame)
+        if moved or self.last_result is None or self.consecutive_skips >= self.max_skips:
+            self.consecutive_skips = 0
+            self.hits += 1
+            return True
+        self.consecutive_skips += 1
+        self.skips += 1
+        return False
+
+    def detect(self, detector, frame):
+        """Returns detector.detect_objects(frame), or the last result when nothing moved"""
+        if self.needs_detection(frame):
+            self.last_result = detector.detect_objects(frame)
+        return self.last_result
+
+    @property
+    def skip_ratio(self):
+        total = self.hits + self.skips
+        return self.skips / total if total else 0.0
+
+    def stats(self):
+        """Inference hit/skip counts since start"""
+        return {"hits": self.hits, "skips": self.skips, "skip_ratio": round(self.skip_ratio, 3),
+                "last_change": round(self.last_change, 4)}
@@ -0,0 +1,290 @@
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+from time import monotonic
+
+from detector import Detector
+from metrics import REGISTRY
+from data import Data
+from debug_stream import DebugStream
+from motion import MotionGate
+from scheduler import AdaptiveScheduler
+from workers import InferencePool
+
+
+# Passed down the stages once a finite source runs out
+END = object()
+
+
+class DropOldestQueue(Queue):
+    """
+    Bounded queue that discards its oldest item instead of blocking the
+    producer, unless lossless, where it behaves like a plain Queue
+    """
+    def __init__(self, maxsize=1, lossless=False):
+        super().__init__(maxsize)
+        self.lossless = lossless
+        self.dropped = 0
+
+    def put(self, item, block=True, timeout=None):
+        if self.lossless:
+            return super().put(item, block, timeout)
+        with self.mutex:
+            if 0 < self.maxsize <= self._qsize():
+                self._get()
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+class Stage(Thread):
+    """
+    Worker thread running one step of the pipeline. Items are taken from
+    inbox (or produced from nothing when inbox is None), passed through work
+    and anything other than None is forwarded to outbox. interval is the
+    minimum time between two runs of the stage, or a callable returning it
+    before each wait. A stage ends when work raises EOFError or END arrives
+    in its inbox, passing END on to the next one.
+    """
+    def __init__(self, name, work, inbox=None, outbox=None, interval=0.0, stop_event=None):
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.interval = interval
+        self.stop_event = stop_event or Event()
+        self.processed = 0
+        self.errors = 0
+        # Last time the stage made progress (finished work or found its inbox
+        # empty), for spotting a stage stuck in work or failing every step
+        self.beat = monotonic()
+
+    def _forward(self, item):
+        # Lossless queues block when full, keep checking for a stop meanwhile
+        while not self.stop_event.is_set():
+            try:
+                self.outbox.put(item, timeout=0.5)
+                return
+            except Full:
+                continue
+
+    def _end(self):
+        if self.outbox is not None:
+            self._forward(END)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            started = monotonic()
+            if self.inbox is None:
+                item = None
+            else:
+                try:
+                    item = self.inbox.get(timeout=0.5)
+                except Empty:
+                    self.beat = monotonic()
+                    continue
+                if item is END:
+                    self._end()
+                    return
+            try:
+                output = self.work() if self.inbox is None else self.work(item)
+            except EOFError:
+                self._end()
+                return
+            except Exception as err:
+                self.errors += 1
+                print(f"{self.name} stage failed: {err}")
+                output = None
+            else:
+                self.beat = monotonic()
+            self.processed += 1
+            if output is not None and self.outbox is not None:
+                self._forward(output)
+            interval = self.interval() if callable(self.interval) else self.interval
+            remaining = interval - (monotonic() - started)
+            if remaining > 0:
+                self.stop_event.wait(remaining)
+
+
+class Pipeline(object):
+    """
+    Capture -> inference -> aggregation -> upload, each stage on its own
+    thread joined by bounded drop-oldest queues so a slow upload can never
+    hold up the camera or the interpreter. Finished samples are handed to
+    sink, Data.post_data unless another (e.g. Spool.put) is given. With a
+    scheduler the capture interval follows scheduler.next_interval() and the
+    scheduler is fed every count and motion level.
+
+    capture is any sources.FrameSource. When it runs out the remaining
+    items drain through and wait() returns. lossless makes every queue (and
+    pool submission) block instead of dropping, for replaying recordings as
+    fast as inference allows.
+
+    A debug_stream is offered every inferred frame with its detections; it
+    ignores them while nobody is watching. In pool mode the frame travels
+    in the submission's meta while a viewer is connected, and is published
+    when its result comes back.
+    """
+    def __init__(self, detector:Detector, capture, data:Data=None, capture_interval=10.0,
+                 inference_interval=0.0, upload_interval=1.0, queue_size=2, sink=None,
+                 motion_gate:MotionGate=None, pool:InferencePool=None, source_id="camera",
+                 scheduler:AdaptiveScheduler=None, lossless=False, debug_stream:DebugStream=None):
+        self.detector = detector
+        self.scheduler = scheduler
+        if scheduler is not None:
+            capture_interval = scheduler.next_interval
+        self.pool = pool
+        self.source_id = source_id
+        self.motion_gate = motion_gate
+        self.capture = capture
+        self.data = data or Data()
+        self.sink = sink or self.data.post_data
+        self.stop_event = Event()
+        self.lossless = lossless
+        self.debug_stream = debug_stream
+        self.source_done = Event()
+        self.frames = DropOldestQueue(queue_size, lossless)
+        self.results = DropOldestQueue(queue_size, lossless)
+        self.samples = DropOldestQueue(queue_size, lossless)
+        if pool is None:
+            inference_stages = [
+                Stage("capture", self._capture, None, self.frames, capture_interval, self.stop_event),
+                Stage("inference", self._infer, self.frames, self.results, inference_interval,
+                      self.stop_event),
+            ]
+        else:
+            # Frames go straight to the worker processes, collect hands their
+            # results on in capture order
+            inference_stages = [
+                Stage("capture", self._submit, None, None, capture_interval, self.stop_event),
+                Stage("collect", self._collect, None, self.results, inference_interval, self.stop_event),
+            ]
+        self.stages = inference_stages + [
+            Stage("aggregate", self._aggregate, self.results, self.samples, 0.0, self.stop_event),
+            Stage("upload", self.sink, self.samples, None, upload_interval, self.stop_event),
+        ]
+
+    def _capture(self):
+        # The capture buffer is reused, so hand a copy to the inference stage
+        with REGISTRY.time("capture"):
+            frame = self.capture.capture().copy()
+        return monotonic(), self.capture.timestamp, frame
+
+    def _submit(self):
+        try:
+            with REGISTRY.time("capture"):
+                frame = self.capture.capture().copy()
+        except EOFError:
+            self.source_done.set()
+            raise
+        # Only hold on to the frame while it has somewhere to be shown
+        shown = None
+        if self.debug_stream is not None and self.debug_stream.watching:
+            shown = frame
+        if self.motion_gate is not None:
+            # A still frame reuses the last result, it is only queued so the
+            # result comes back in capture order
+            if not self.motion_gate.needs_detection(frame):
+                frame = None
+            if self.scheduler is not None:
+                self.scheduler.observe(motion=self.motion_gate.last_change)
+        # Never block the camera on busy workers, drop the frame instead
+        self.pool.submit(self.source_id, frame, meta=(monotonic(), self.capture.timestamp, shown),
+                         block=self.lossless)
+
+    def _collect(self):
+        try:
+            result = self.pool.get(timeout=0.5)
+        except RuntimeError as err:
+            # No worker left to run frames, stop rather than spin on the error
+            print(f"Stopping the pipeline: {err}")
+            self.stop_event.set()
+            return None
+        if result is None:
+            if self.source_done.is_set() and self.pool.outstanding == 0:
+                raise EOFError("Source finished and every frame collected")
+            return None
+        if result.error is not None:
+            raise RuntimeError(result.error)
+        detections = result.detections
+        if self.motion_gate is not None:
+            if detections is None:
+                # Skipped by the motion gate
+                detections = self.motion_gate.last_result
+                if detections is None:
+                    return None
+            else:
+                self.motion_gate.last_result = detections
+        captured_at, timestamp, shown = result.meta
+        if shown is not None:
+            self.debug_stream.publish(shown, detections, [f"Person count: {len(detections)}"])
+        if result.detections is not None:
+            # Stage timings of the workers stay in their processes, record the
+            # time from capture to result instead
+            REGISTRY.observe("pool", monotonic() - captured_at)
+        return captured_at, timestamp, detections
+
+    def _infer(self, item):
+        captured_at, timestamp, image = item
+        if self.motion_gate is not None:
+            detections = self.motion_gate.detect(self.detector, image)
+            if self.scheduler is not None:
+                self.scheduler.observe(motion=self.motion_gate.last_change)
+        else:
+            detections = self.detector.detect_objects(image)
+        if self.debug_stream is not None:
+            self.debug_stream.publish(image, detections, [f"Person count: {len(detections)}"])
+        return captured_at, timestamp, detections
+
+    def _aggregate(self, item):
+        captured_at, timestamp, self.data.detection_list = item
+        if self.scheduler is not None:
+            self.scheduler.observe(count=len(self.data.detection_list))
+        with REGISTRY.time("aggregate"):
+            sample = self.data.aggregate(timestamp)
+        REGISTRY.observe("frame", monotonic() - captured_at)
+        return sample
+
+    @property
+    def dropped(self):
+        """Items discarded by backpressure, per queue"""
+        return {"frames": self.frames.dropped, "results": self.results.dropped,
+                "samples": self.samples.dropped}
+
+    def stats(self):
+        """Frames read, backpressure drops, motion gate hit/skip counts and scheduler state when used"""
+        stats = {"frames": self.capture.frames_read, "dropped": self.dropped}
+        if self.pool is not None:
+            stats["dropped"]["pool"] = self.pool.dropped
+        if self.motion_gate is not None:
+            stats["motion"] = self.motion_gate.stats()
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        return stats
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def healthy(self, stall=60.0):
+        """
+        Whether every stage (and with a pool, some worker) is running and
+        every stage has made progress in the last stall seconds, a stage
+        whose work keeps raising counts as stalled
+        """
+        now = monotonic()
+        if self.pool is not None and not self.pool.alive:
+            return False
+        return all(stage.is_alive() and now - stage.beat < stall for stage in self.stages)
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def wait(self):
+        """Blocks until the pipeline is stopped or its source has drained through"""
+        while not self.stop_event.wait(0.2):
+            if not any(stage.is_alive() for stage in self.stages):
+                break
@@ -0,0 +1,131 @@
+import json
+import numpy as np
+
+from boxes import centers
+from detector import CAMERA_WIDTH, CAMERA_HEIGHT
+from metrics import REGISTRY
+
+
+class RegionOfInterest(object):
+    """
+    One or more polygons of relative [y, x] vertices (the convention of the
+    boxes and the count line) marking where people should be counted.
+
+    Only the bounding rectangle of the polygons, widened by padding, is
+    sent to the model, so its fixed input resolution is spent on the area
+    that matters. Detections are then kept when their anchor point ('center'
+    or 'bottom', the middle of the box's lower edge) lies inside a polygon.
+    """
+    def __init__(self, polygons, padding=0.02, anchor='center'):
+        if anchor not in ('center', 'bottom'):
+            raise ValueError(f"Unknown anchor {anchor}, expected center or bottom")
+        self.polygons = [np.asarray(polygon, dtype=np.float32).reshape(-1, 2) for polygon in polygons]
+        if not self.polygons or any(len(polygon) < 3 for polygon in self.polygons):
+            raise ValueError("Every polygon needs at least 3 [y, x] vertices")
+        self.anchor = anchor
+        vertices = np.concatenate(self.polygons)
+        low = np.clip(vertices.min(axis=0) - padding, 0, 1)
+        high = np.clip(vertices.max(axis=0) + padding, 0, 1)
+        # [ymin, xmin, ymax, xmax] of the crop, relative to the frame
+        self.bounds = np.concatenate([low, high]).astype(np.float32)
+        # Every polygon edge as (y0, x0, y1, x1) plus a one-hot polygon
+        # membership, so the crossing count of all polygons is one matmul
+        starts = np.concatenate(self.polygons)
+        ends = np.concatenate([np.roll(polygon, -1, axis=0) for polygon in self.polygons])
+        self.edges = np.hstack([starts, ends])
+        membership = np.repeat(np.arange(len(self.polygons)), [len(p) for p in self.polygons])
+        self.membership = np.eye(len(self.polygons), dtype=np.int32)[membership]
+        self._layouts = {}
+
+    @classmethod
+    def load(cls, path, camera_id=None, **options):
+        """
+        Reads a JSON list of polygons, or an object mapping camera ids to
+        lists of polygons with an optional "default" entry
+        """
+        with open(path) as f:
+            config = json.load(f)
+        if isinstance(config, dict):
+            if camera_id in config:
+                config = config[camera_id]
+            elif 'default' in config:
+                config = config['default']
+            else:
+                raise KeyError(f"No region of interest for camera {camera_id} in {path}")
+        return cls(config, **options)
+
+    def contains(self, points):
+        """points: (N, 2) relative [y, x] -> (N,) whether each lies inside any polygon"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        y, x = points[:, :1], points[:, 1:]
+        y0, x0, y1, x1 = self.edges.T
+        # Even-odd rule: count the edges a ray running right from the point crosses
+        straddles = (y0 > y) != (y1 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        crossings = (straddles & (x < crossing_x)).astype(np.int32) @ self.membership
+        return (crossings % 2 == 1).any(axis=1)
+
+    def _layout(self, height, width, out_width, out_height):
+        key = (height, width, out_width, out_height)
+        if key not in self._layouts:
+            y0, x0 = int(self.bounds[0] * height), int(self.bounds[1] * width)
+            y1 = max(int(np.ceil(self.bounds[2] * height)), y0 + 1)
+            x1 = max(int(np.ceil(self.bounds[3] * width)), x0 + 1)
+            rows = y0 + np.arange(out_height) * (y1 - y0) // out_height
+            cols = x0 + np.arange(out_width) * (x1 - x0) // out_width
+            self._layouts[key] = (rows[:, None], cols)
+        return self._layouts[key]
+
+    def crop(self, frame, width, height):
+        """Crops the ROI bounds out of frame resampled to width x height, in one gather"""
+        rows, cols = self._layout(frame.shape[0], frame.shape[1], width, height)
+        return frame[rows, cols]
+
+    def to_frame(self, results):
+        """Maps boxes relative to the crop back to frame relative coordinates, in place"""
+        ymin, xmin, ymax, xmax = self.bounds
+        scale = np.array([ymax - ymin, xmax - xmin, ymax - ymin, xmax - xmin], dtype=np.float32)
+        offset = np.array([ymin, xmin, ymin, xmin], dtype=np.float32)
+        results['bounding_box'] = results['bounding_box'] * scale + offset
+        return results
+
+    def filter(self, results):
+        """Keeps the detections whose anchor point lies inside the region"""
+        if len(results) == 0:
+            return results
+        boxes = results['bounding_box']
+        points = centers(boxes)
+        if self.anchor == 'bottom':
+            points[:, 0] = boxes[:, 2]
+        return results[self.contains(points)]
+
+
+class RoiDetector(object):
+    """
+    Wraps a detector (or backend) so it only looks at a RegionOfInterest.
+    Frames are captured at capture_size, the crop is resampled to the inner
+    detector's capture size and the boxes come back frame relative.
+    """
+    def __init__(self, detector, roi:RegionOfInterest, capture_size=(CAMERA_WIDTH, CAMERA_HEIGHT)):
+        self.detector = detector
+        self.roi = roi
+        self._capture_size = capture_size
+
+    @property
+    def capture_size(self):
+        return self._capture_size
+
+    @property
+    def labels(self):
+        return self.detector.labels
+
+    def detect_objects(self, frame):
+        with REGISTRY.time("crop"):
+            crop = self.roi.crop(np.asarray(frame), *self.detector.capture_size)
+        results = self.detector.detect_objects(crop)
+        with REGISTRY.time("roi_filter"):
+            return self.roi.filter(self.roi.to_frame(results))
+
+    def annotate_objects(self, annotator, results):
+        self.detector.annotate_objects(annotator, results)
@@ -1,6 +1,16 @@
-from camera import start_background, watch_background
-from detector import Detector
-import argparse
+from startup import STARTUP
+
+with STARTUP.phase("imports"):
+    from camera import start_background, watch_background
+    from data import settings
+    from aggregator import Aggregator, STATISTICS
+    from roi import RegionOfInterest, RoiDetector
+    from scheduler import AdaptiveScheduler
+    from sources import SOURCES, PiCameraSource, JpegDirectorySource, VideoSource, SyntheticSource
+    from backends import BACKENDS, load_backend
+    from workers import InferencePool
+    from concurrent.futures import ThreadPoolExecutor
+    import argparse
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -25,11 +35,263 @@ if __name__ == "__main__":
         required=False,
         type=bool,
         default=0)
+    parser.add_argument(
+        '--capture-interval',
+        help='Seconds between captures in background mode with --schedule fixed.',
+        required=False,
+        type=float,
+        default=10.0)
+    parser.add_argument(
+        '--schedule',
+        help='fixed: capture every --capture-interval seconds, adaptive: between --min-interval '
+             'and --max-interval depending on activity and the CPU budget.',
+        required=False,
+        choices=['fixed', 'adaptive'],
+        default='adaptive')
+    parser.add_argument(
+        '--min-interval',
+        help='Shortest adaptive capture interval in seconds, used while the scene changes.',
+        required=False,
+        type=float,
+        default=1.0)
+    parser.add_argument(
+        '--max-interval',
+        help='Longest adaptive capture interval in seconds, reached while the scene is steady.',
+        required=False,
+        type=float,
+        default=30.0)
+    parser.add_argument(
+        '--max-temperature',
+        help='SoC temperature in degrees C above which adaptive capture slows down.',
+        required=False,
+        type=float,
+        default=75.0)
+    parser.add_argument(
+        '--max-load',
+        help='Load average per core above which adaptive capture slows down.',
+        required=False,
+        type=float,
+        default=0.9)
+    parser.add_argument(
+        '--inference-interval',
+        help='Minimum seconds between inferences in background mode.',
+        required=False,
+        type=float,
+        default=0.0)
+    parser.add_argument(
+        '--upload-interval',
+        help='Minimum seconds between uploads in background mode.',
+        required=False,
+        type=float,
+        default=1.0)
+    parser.add_argument(
+        '--motion-threshold',
+        help='Fraction of changed pixels needed to run inference on a frame, 0 disables gating.',
+        required=False,
+        type=float,
+        default=0.01)
+    parser.add_argument(
+        '--detect-every',
+        help='Run the detector every N frames in watch mode, tracking in between.',
+        required=False,
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--count-line',
+        help='Entry/exit counting line in watch mode as relative y1,x1,y2,x2.',
+        required=False,
+        type=lambda value: [[float(v) for v in value.split(',')[i:i + 2]] for i in (0, 2)],
+        default=None)
+    parser.add_argument(
+        '--tiles',
+        help='Run tiled inference on the full frame with ROWSxCOLS overlapping tiles, e.g. 2x2.',
+        required=False,
+        type=lambda value: tuple(int(v) for v in value.lower().split('x')),
+        default=None)
+    parser.add_argument(
+        '--tile-overlap',
+        help='Fraction of each tile shared with its neighbours.',
+        required=False,
+        type=float,
+        default=0.2)
+    parser.add_argument(
+        '--tile-workers',
+        help='Number of interpreters running tiles in parallel.',
+        required=False,
+        type=int,
+        default=4)
+    parser.add_argument(
+        '--workers',
+        help='Inference worker processes in background mode, 0 runs inference in-process.',
+        required=False,
+        type=int,
+        default=0)
+    parser.add_argument(
+        '--num-threads',
+        help='Threads used by each interpreter.',
+        required=False,
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--backend',
+        help='Comma separated inference backends to try in order: ' + ', '.join(BACKENDS),
+        required=False,
+        default='tflite')
+    parser.add_argument(
+        '--statistic',
+        help='Statistic uploaded for each window: ' + ', '.join(STATISTICS),
+        required=False,
+        choices=list(STATISTICS),
+        default='median')
+    parser.add_argument(
+        '--window',
+        help='Number of frames per aggregation window.',
+        required=False,
+        type=int,
+        default=5)
+    parser.add_argument(
+        '--window-seconds',
+        help='Aggregate over a time window of this many seconds instead of a frame count.',
+        required=False,
+        type=float,
+        default=None)
+    parser.add_argument(
+        '--emit',
+        help='window: upload once per window, change: upload when the smoothed count changes.',
+        required=False,
+        choices=['window', 'change'],
+        default='window')
+    parser.add_argument(
+        '--change-threshold',
+        help='Smoothed count change that triggers an upload in change mode.',
+        required=False,
+        type=float,
+        default=1.0)
+    parser.add_argument(
+        '--heartbeat',
+        help='Maximum seconds between uploads in change mode.',
+        required=False,
+        type=float,
+        default=600.0)
+    parser.add_argument(
+        '--roi',
+        help='JSON file of relative [y, x] polygons to count in, or of such lists keyed by DEVICE_ID.',
+        required=False,
+        default=None)
+    parser.add_argument(
+        '--roi-anchor',
+        help='Point of each box that must lie inside the region.',
+        required=False,
+        choices=['center', 'bottom'],
+        default='center')
+    parser.add_argument(
+        '--source',
+        help='Where frames come from: ' + ', '.join(SOURCES),
+        required=False,
+        choices=list(SOURCES),
+        default='picamera')
+    parser.add_argument(
+        '--source-path',
+        help='Directory of JPEGs or video file for the jpeg and video sources.',
+        required=False,
+        default=None)
+    parser.add_argument(
+        '--video-start',
+        help='Epoch seconds the video source was recorded at, frames are stamped from it.',
+        required=False,
+        type=float,
+        default=None)
+    parser.add_argument(
+        '--fps',
+        help='Pace replayed and synthetic frames to this rate, unpaced when not given.',
+        required=False,
+        type=float,
+        default=None)
+    parser.add_argument(
+        '--prefetch',
+        help='Frames decoded ahead on a background thread by the jpeg and video sources.',
+        required=False,
+        type=int,
+        default=4)
+    parser.add_argument(
+        '--max-speed',
+        help='Replay the source as fast as inference allows in background mode, without dropping frames.',
+        required=False,
+        action='store_true')
+    parser.add_argument(
+        '--debug-port',
+        help='Serve annotated frames as an MJPEG stream on this port while a browser is connected.',
+        required=False,
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--metrics-port',
+        help='Serve stage timings in the Prometheus format on this port in background mode.',
+        required=False,
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--metrics-interval',
+        help='Seconds between stage timing log lines in background mode, 0 disables them.',
+        required=False,
+        type=float,
+        default=60.0)
     args = parser.parse_args()
 
-    detector = Detector(args.model, args.labels, args.threshold)
+    detector_options = dict(tiles=args.tiles, tile_overlap=args.tile_overlap,
+                            tile_workers=args.tile_workers, num_threads=args.num_threads)
+    roi = None
+    if args.roi:
+        roi = RegionOfInterest.load(args.roi, settings().DEVICE_ID, anchor=args.roi_anchor)
+
+    if args.source == 'jpeg':
+        source = JpegDirectorySource(args.source_path, fps=args.fps, prefetch=args.prefetch)
+    elif args.source == 'video':
+        source = VideoSource(args.source_path, start_time=args.video_start, fps=args.fps,
+                             prefetch=args.prefetch)
+    elif args.source == 'synthetic':
+        source = SyntheticSource(fps=args.fps)
+    else:
+        source = PiCameraSource()
+
+    def prepare_source():
+        with STARTUP.phase("camera"):
+            source.prepare()
+
+    # The camera powers up and settles while the model loads and warms up
+    with ThreadPoolExecutor(1, thread_name_prefix="camera-init") as executor:
+        camera_ready = executor.submit(prepare_source)
+        with STARTUP.phase("model"):
+            pool = None
+            if args.workers and not args.watch:
+                detector = None
+                pool = InferencePool(args.model, args.labels, args.threshold, workers=args.workers,
+                                     roi=roi, backends=args.backend.split(','), **detector_options)
+            else:
+                detector = load_backend(args.backend.split(','), model=args.model, labels=args.labels,
+                                        threshold=args.threshold, **detector_options)
+                if roi is not None:
+                    detector = RoiDetector(detector, roi)
+        camera_ready.result()
+
+    scheduler = None
+    if args.schedule == 'adaptive':
+        scheduler = AdaptiveScheduler(args.min_interval, args.max_interval,
+                                      max_temperature=args.max_temperature, max_load=args.max_load)
 
     if args.watch:
-        watch_background(detector)
+        watch_background(detector, motion_threshold=args.motion_threshold,
+                         detect_every=args.detect_every, count_line=args.count_line, source=source,
+                         debug_port=args.debug_port)
     else:
-        start_background(detector)
+        start_background(detector, capture_interval=args.capture_interval,
+                         inference_interval=args.inference_interval,
+                         upload_interval=args.upload_interval,
+                         motion_threshold=args.motion_threshold, pool=pool,
+                         aggregator=Aggregator(args.statistic, window=args.window,
+                                               window_seconds=args.window_seconds, emit=args.emit,
+                                               change_threshold=args.change_threshold,
+                                               heartbeat=args.heartbeat),
+                         metrics_port=args.metrics_port, metrics_interval=args.metrics_interval,
+                         scheduler=scheduler, source=source, max_speed=args.max_speed,
+                         debug_port=args.debug_port)
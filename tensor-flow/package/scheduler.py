@@ -0,0 +1,115 @@
+import os
+from collections import deque
+from threading import Lock
+from time import monotonic
+
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+
+
+class SysfsBudgetSource(object):
+    """
+    Reads the SoC temperature (degrees C) from sysfs and the 1 minute load
+    average per core. Either value is None when it cannot be read, e.g.
+    off the Pi
+    """
+    def __init__(self, thermal_path=THERMAL_ZONE):
+        self.thermal_path = thermal_path
+        self.cpus = os.cpu_count() or 1
+
+    def __call__(self):
+        try:
+            with open(self.thermal_path) as f:
+                temperature = int(f.read().strip()) / 1000
+        except (OSError, ValueError):
+            temperature = None
+        try:
+            load = os.getloadavg()[0] / self.cpus
+        except OSError:
+            load = None
+        return {"temperature": temperature, "load": load}
+
+
+class AdaptiveScheduler(object):
+    """
+    Capture interval that follows the scene. Activity is the larger of the
+    recent count volatility (mean absolute change between consecutive
+    counts, relative to volatility_scale) and the motion level (fraction of
+    changed pixels, relative to motion_scale). Rising activity drops the
+    interval towards min_interval straight away; once the scene is steady
+    it grows back towards max_interval by at most backoff times per capture.
+
+    source() returns {"temperature": C, "load": per core}, read at most
+    every budget_poll seconds. While either is over max_temperature or
+    max_load the interval is held at throttle times the activity target.
+    """
+    def __init__(self, min_interval=1.0, max_interval=30.0, window=6, volatility_scale=1.0,
+                 motion_scale=0.05, backoff=1.5, max_temperature=75.0, max_load=0.9, throttle=3.0,
+                 budget_poll=10.0, source=None, clock=monotonic):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("Expected 0 < min_interval <= max_interval")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.counts = deque(maxlen=window)
+        self.volatility_scale = volatility_scale
+        self.motion_scale = motion_scale
+        self.backoff = backoff
+        self.max_temperature = max_temperature
+        self.max_load = max_load
+        self.throttle = throttle
+        self.budget_poll = budget_poll
+        self.source = source or SysfsBudgetSource()
+        self.clock = clock
+        self.motion = 0.0
+        self.interval = max_interval
+        self.budget = {"temperature": None, "load": None}
+        self.budget_read_at = None
+        self.throttled = False
+        self.lock = Lock()
+
+    def observe(self, count=None, motion=None):
+        """Feeds the latest person count and/or motion level"""
+        with self.lock:
+            if count is not None:
+                self.counts.append(count)
+            if motion is not None:
+                self.motion = motion
+
+    @property
+    def volatility(self):
+        counts = list(self.counts)
+        if len(counts) < 2:
+            return 0.0
+        return sum(abs(b - a) for a, b in zip(counts, counts[1:])) / (len(counts) - 1)
+
+    @property
+    def activity(self):
+        """0 for a steady empty scene to 1 for a busy one"""
+        with self.lock:
+            volatility = self.volatility / self.volatility_scale
+            motion = self.motion / self.motion_scale
+        return min(1.0, max(volatility, motion))
+
+    def _over_budget(self):
+        now = self.clock()
+        if self.budget_read_at is None or now - self.budget_read_at >= self.budget_poll:
+            self.budget = self.source()
+            self.budget_read_at = now
+        temperature, load = self.budget.get("temperature"), self.budget.get("load")
+        return ((temperature is not None and temperature > self.max_temperature) or
+                (load is not None and load > self.max_load))
+
+    def next_interval(self):
+        """-> (float) seconds to wait before the next capture"""
+        target = self.max_interval - (self.max_interval - self.min_interval) * self.activity
+        self.throttled = self._over_budget()
+        if self.throttled:
+            target = min(self.max_interval, target * self.throttle)
+        if target < self.interval:
+            self.interval = target
+        else:
+            self.interval = min(target, self.interval * self.backoff)
+        return self.interval
+
+    def stats(self):
+        return {"interval": round(self.interval, 2), "activity": round(self.activity, 3),
+                "throttled": self.throttled, **self.budget}
@@ -1,15 +1,15 @@
-from gpiozero import LED, Button
 from signal import pause
 from threading import Thread, Event
 
-led = LED(4)
-button = Button(17)
-
 # Event Signal
 button_press = Event()
 
 # Decorator to implement function start and stop via button
 def button_interrupt(func):
+	# The pins are claimed when a function is wrapped rather than on import
+	from gpiozero import LED, Button
+	led = LED(4)
+	button = Button(17)
 
 	func_thread = Thread(target=func, name="function")
 	func_thread.start()
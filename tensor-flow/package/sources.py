@@ -0,0 +1,319 @@
+import glob
+import os
+import numpy as np
+from queue import Queue, Full
+from threading import Thread, Event
+from time import sleep, monotonic
+
+from capture import RGBCapture
+from metrics import REGISTRY
+
+
+class FrameSource(object):
+    """
+    Source of HxWx3 uint8 RGB frames for the detection loops. Call
+    open(width, height) before capturing; capture() returns the next frame
+    (which may be overwritten by the following capture) and raises EOFError
+    once a finite source runs out. timestamp is the epoch time the last
+    frame was recorded at, None for live frames.
+
+    With prefetch > 0 up to that many frames are read and decoded ahead on a
+    background thread. fps paces capture() to real time, None returns
+    frames as fast as they are asked for.
+
+    prepare() does the slow part of opening that does not depend on the
+    frame size (powering up a camera), and can run on another thread while
+    the model loads; open() calls it if nobody has.
+
+    Subclasses implement _read() -> (frame, timestamp) and optionally
+    _prepare(), _open() and _close().
+    """
+    # picamera.PiCamera when the source has one, for preview overlays
+    camera = None
+
+    def __init__(self, fps=None, prefetch=0):
+        self.fps = fps
+        self.prefetch = prefetch
+        self.width = self.height = None
+        self.timestamp = None
+        self.frames_read = 0
+        self._queue = None
+        self._thread = None
+        self._stop = Event()
+        self._exhausted = False
+        self._next_due = None
+        self._prepared = False
+
+    def prepare(self):
+        if not self._prepared:
+            self._prepare()
+            self._prepared = True
+        return self
+
+    def open(self, width, height):
+        self.width, self.height = width, height
+        self.prepare()
+        self._open()
+        if self.prefetch:
+            self._queue = Queue(self.prefetch)
+            self._thread = Thread(target=self._read_ahead, name="prefetch", daemon=True)
+            self._thread.start()
+        return self
+
+    def _prepare(self):
+        pass
+
+    def _open(self):
+        pass
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def _read_ahead(self):
+        while not self._stop.is_set():
+            try:
+                item = self._read()
+            except EOFError:
+                item = None
+            except Exception as err:
+                item = err
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.5)
+                    break
+                except Full:
+                    continue
+            if item is None or isinstance(item, Exception):
+                return
+
+    def read(self):
+        """-> (frame, timestamp) of the next frame without pacing"""
+        if self._exhausted:
+            raise EOFError("Frame source exhausted")
+        if self._queue is None:
+            return self._read()
+        item = self._queue.get()
+        if item is None:
+            self._exhausted = True
+            raise EOFError("Frame source exhausted")
+        if isinstance(item, Exception):
+            self._exhausted = True
+            raise item
+        return item
+
+    def _pace(self):
+        if not self.fps:
+            return
+        now = monotonic()
+        if self._next_due is not None and self._next_due > now:
+            sleep(self._next_due - now)
+            now = self._next_due
+        self._next_due = now + 1 / self.fps
+
+    def capture(self):
+        self._pace()
+        frame, self.timestamp = self.read()
+        self.frames_read += 1
+        return frame
+
+    def capture_continuous(self):
+        """Yields frames until the source runs out"""
+        while True:
+            try:
+                yield self.capture()
+            except EOFError:
+                return
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _pi_camera():
+    """Imported on demand so the sources work off the Pi"""
+    from picamera import PiCamera
+    return PiCamera
+
+
+class PiCameraSource(FrameSource):
+    """
+    Live frames from the Pi camera, captured as raw RGB at the requested
+    size. camera_cls can stand in for picamera.PiCamera, e.g. FakeCamera.
+    """
+    def __init__(self, camera_cls=None, resolution=(640, 480), framerate=30, use_video_port=False,
+                 warm_up=2.0):
+        super().__init__()
+        self.camera_cls = camera_cls
+        self.resolution = resolution
+        self.framerate = framerate
+        self.use_video_port = use_video_port
+        self.warm_up = warm_up
+        self.rgb = None
+        self.settled_at = None
+
+    def _prepare(self):
+        camera_cls = self.camera_cls or _pi_camera()
+        self.camera = camera_cls(resolution=self.resolution, framerate=self.framerate)
+        self.camera.vflip = False
+        self.camera.exposure_mode = 'sports'
+        self.camera.led = True
+        self.settled_at = monotonic() + self.warm_up
+
+    def _open(self):
+        self.rgb = RGBCapture(self.camera, self.width, self.height, self.use_video_port)
+        # Let the sensor settle its gains before the first capture, only
+        # what is left of it when the model was loaded meanwhile
+        remaining = self.settled_at - monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+    def _read(self):
+        return self.rgb.capture(), None
+
+    def capture_continuous(self):
+        # The camera's own continuous capture keeps the pipeline running
+        # between frames, much faster than repeated capture() calls
+        for frame in self.rgb.capture_continuous():
+            self.frames_read += 1
+            yield frame
+
+    def _close(self):
+        if self.camera is not None:
+            self.camera.close()
+
+
+class JpegDirectorySource(FrameSource):
+    """
+    Replays the JPEGs of a directory (e.g. the img###.jpg files picam.py
+    writes) in name order, stamped with their modification times
+    """
+    def __init__(self, path, pattern="*.jpg", fps=None, prefetch=4):
+        super().__init__(fps, prefetch)
+        self.paths = sorted(glob.glob(os.path.join(path, pattern)))
+        if not self.paths:
+            raise FileNotFoundError(f"No {pattern} files in {path}")
+        self.index = 0
+
+    def _read(self):
+        from PIL import Image
+        if self.index >= len(self.paths):
+            raise EOFError("No more images")
+        path = self.paths[self.index]
+        self.index += 1
+        with REGISTRY.time("decode"):
+            with Image.open(path) as image:
+                # Lets the JPEG decoder skip straight to a reduced scale
+                image.draft('RGB', (self.width, self.height))
+                image = image.convert('RGB')
+                if image.size != (self.width, self.height):
+                    image = image.resize((self.width, self.height))
+                frame = np.asarray(image)
+        return frame, os.path.getmtime(path)
+
+
+class VideoSource(FrameSource):
+    """
+    Replays a video file through OpenCV. Frames are stamped start_time plus
+    their position in the video when start_time is given
+    """
+    def __init__(self, path, start_time=None, fps=None, prefetch=4):
+        super().__init__(fps, prefetch)
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.start_time = start_time
+        self.video = None
+
+    def _open(self):
+        import cv2
+        self._cv2 = cv2
+        self.video = cv2.VideoCapture(self.path)
+        if not self.video.isOpened():
+            raise IOError(f"Cannot open video {self.path}")
+
+    def _read(self):
+        cv2 = self._cv2
+        with REGISTRY.time("decode"):
+            ok, frame = self.video.read()
+            if not ok:
+                raise EOFError("End of video")
+            if frame.shape[:2] != (self.height, self.width):
+                frame = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        timestamp = None
+        if self.start_time is not None:
+            timestamp = self.start_time + self.video.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        return frame, timestamp
+
+    def _close(self):
+        if self.video is not None:
+            self.video.release()
+
+
+class SyntheticSource(FrameSource):
+    """
+    Bright boxes moving across a grey background, their number drifting
+    between 0 and people over a period of frames. truth is the number of
+    boxes in the last frame. Endless unless frames is given. Frames are
+    cheap to draw, so there is no prefetching that would get truth ahead
+    of the frame being processed
+    """
+    def __init__(self, people=3, frames=None, period=200, seed=0, fps=None):
+        super().__init__(fps)
+        self.people = people
+        self.frames = frames
+        self.period = period
+        self.rng = np.random.default_rng(seed)
+        self.truth = 0
+        self.index = 0
+        self.boxes = None
+
+    def _open(self):
+        box_w, box_h = max(self.width // 10, 1), max(self.height // 3, 1)
+        self.box_size = box_w, box_h
+        self.boxes = np.column_stack([
+            self.rng.integers(0, max(self.width - box_w, 1), self.people),
+            self.rng.integers(0, max(self.height - box_h, 1), self.people),
+            self.rng.choice([-6, -4, 4, 6], self.people),
+            self.rng.choice([-2, 0, 2], self.people),
+        ])
+
+    def _read(self):
+        if self.frames is not None and self.index >= self.frames:
+            raise EOFError("Synthetic source finished")
+        phase = np.sin(2 * np.pi * self.index / self.period)
+        visible = int(round((phase + 1) / 2 * self.people))
+        self.index += 1
+        box_w, box_h = self.box_size
+        boxes = self.boxes
+        boxes[:, 0] += boxes[:, 2]
+        boxes[:, 1] += boxes[:, 3]
+        # Bounce off the edges
+        for axis, limit in ((0, self.width - box_w), (1, self.height - box_h)):
+            out = (boxes[:, axis] < 0) | (boxes[:, axis] > limit)
+            boxes[out, axis + 2] *= -1
+            boxes[:, axis] = np.clip(boxes[:, axis], 0, max(limit, 0))
+        frame = np.full((self.height, self.width, 3), 96, dtype=np.uint8)
+        for x, y, _, _ in boxes[:visible]:
+            frame[y:y + box_h, x:x + box_w] = 220
+        self.truth = visible
+        return frame, None
+
+
+SOURCES = {
+    'picamera': PiCameraSource,
+    'jpeg': JpegDirectorySource,
+    'video': VideoSource,
+    'synthetic': SyntheticSource,
+}
@@ -0,0 +1,184 @@
+import gzip
+import json
+import random
+import sqlite3
+import time
+import wire
+from metrics import REGISTRY
+from datetime import datetime
+from threading import Thread, Event, Lock
+
+
+class Spool(object):
+    """Disk backed FIFO of aggregated samples waiting to be uploaded"""
+    def __init__(self, path="spool.db"):
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        created = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'spool'").fetchone() is None
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL
+            )
+        """)
+        if created:
+            # Spool ids double as the sequence numbers the server dedupes on,
+            # start a fresh spool past any id an earlier spool file handed out
+            self.conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('spool', ?)",
+                              (int(time.time() * 1000),))
+        self.conn.commit()
+
+    def put(self, sample):
+        """sample:(dict) -> (int) spool id of the stored sample"""
+        with self.lock:
+            cursor = self.conn.execute("INSERT INTO spool (payload) VALUES (?)", (json.dumps(sample),))
+            self.conn.commit()
+            return cursor.lastrowid
+
+    def peek(self, n):
+        """n:(integer) -> (list) up to n oldest (id, sample) pairs, left in the spool"""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, payload FROM spool ORDER BY id LIMIT ?", (n,)).fetchall()
+        return [(id, json.loads(payload)) for id, payload in rows]
+
+    def ack(self, ids):
+        """Removes delivered samples from the spool"""
+        if not ids:
+            return
+        with self.lock:
+            self.conn.executemany("DELETE FROM spool WHERE id = ?", [(id,) for id in ids])
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class DeliveryError(Exception):
+    """Raised when only part of a batch reached the server"""
+    def __init__(self, delivered, cause):
+        super().__init__(str(cause))
+        self.delivered = delivered
+
+
+class Uploader(Thread):
+    """
+    Drains the spool in batches over a single keep-alive session. Batches go
+    gzipped to batch_route (the server's /add/batch/) when one is configured,
+    tagged with device_id and the spool ids as sequence numbers so a retried
+    batch is never stored twice, as JSON or, with wire_format='binary', in the
+    compact encoding of wire.py. Otherwise each sample is posted to route on
+    the same connection. Failures back off exponentially and leave the
+    samples in the spool for the next attempt.
+    """
+    def __init__(self, spool, route, batch_route=None, auth=None, batch_size=20, timeout=5.0,
+                 idle_interval=1.0, min_backoff=1.0, max_backoff=300.0, session=None,
+                 device_id="default", wire_format="json"):
+        super().__init__(name="uploader", daemon=True)
+        if wire_format not in ("json", "binary"):
+            raise ValueError(f"Unknown wire format {wire_format}, expected json or binary")
+        self.spool = spool
+        self.route = route
+        self.batch_route = batch_route
+        self.device_id = device_id
+        self.wire_format = wire_format
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.idle_interval = idle_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        if session is None:
+            # Imported on demand, it is one of the slowest imports on a Pi
+            import requests
+            session = requests.Session()
+        self.session = session
+        self.session.auth = auth
+        self.stop_event = Event()
+        self.backoff = min_backoff
+        self.delivered = 0
+        self.failures = 0
+
+    @staticmethod
+    def batch_entry(id, sample):
+        """Spool row -> /add/batch/ sample with the spool id as its sequence number"""
+        ts = datetime.fromisoformat(sample['timestamp']).timestamp()
+        return {"seq": id, "ts": int(ts), "number_ppl": int(round(sample['mode']))}
+
+    def send(self, batch):
+        """batch:(list) (id, sample) pairs -> (list) ids accepted by the server"""
+        if self.batch_route:
+            samples = [self.batch_entry(id, sample) for id, sample in batch]
+            if self.wire_format == "binary":
+                # Already smaller than gzip would make it
+                data = wire.encode(self.device_id, samples)
+                headers = {"Content-Type": wire.CONTENT_TYPE}
+            else:
+                body = {"device": self.device_id, "samples": samples}
+                data = gzip.compress(json.dumps(body).encode())
+                headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+            r = self.session.post(self.batch_route, data=data, headers=headers,
+                                  verify=True, timeout=self.timeout)
+            r.raise_for_status()
+            return [id for id, _ in batch]
+        delivered = []
+        for id, sample in batch:
+            try:
+                r = self.session.post(self.route, json=sample, verify=True, timeout=self.timeout)
+                r.raise_for_status()
+            except Exception as err:
+                raise DeliveryError(delivered, err)
+            delivered.append(id)
+        return delivered
+
+    def drain_once(self):
+        """Sends one batch, returns the number of samples delivered"""
+        batch = self.spool.peek(self.batch_size)
+        if not batch:
+            return 0
+        try:
+            with REGISTRY.time("upload"):
+                delivered = self.send(batch)
+        except Exception as err:
+            partial = getattr(err, "delivered", [])
+            self.spool.ack(partial)
+            self.delivered += len(partial)
+            raise
+        self.spool.ack(delivered)
+        return len(delivered)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                sent = self.drain_once()
+            except Exception as err:
+                self.failures += 1
+                print("Could not send data, retrying in %.0fs\n" % self.backoff)
+                print(err)
+                self.stop_event.wait(self.backoff * random.uniform(0.8, 1.2))
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                continue
+            self.backoff = self.min_backoff
+            self.delivered += sent
+            if sent < self.batch_size:
+                self.stop_event.wait(self.idle_interval)
+
+    @property
+    def longest_send(self):
+        """Seconds one drain_once can take, a request per sample without a batch route"""
+        return self.timeout * (1 if self.batch_route else self.batch_size)
+
+    def stop(self, timeout=None):
+        """
+        Stops after the batch in flight, waiting up to timeout seconds (by
+        default long enough for the slowest send) so its ack reaches the spool
+        """
+        self.stop_event.set()
+        self.join(self.longest_send + 5.0 if timeout is None else timeout)
+        self.session.close()
@@ -0,0 +1,110 @@
+import os
+import socket
+from threading import Thread, Event
+from time import monotonic
+
+from metrics import REGISTRY
+
+
+def notify(*states):
+    """
+    Sends sd_notify states (e.g. "READY=1", "WATCHDOG=1") to systemd through
+    the NOTIFY_SOCKET datagram socket, returns False when not run by systemd
+    """
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address.startswith("@"):
+        # Abstract namespace socket
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto("\n".join(states).encode(), address)
+        return True
+    except OSError as err:
+        print(f"Could not notify systemd: {err}")
+        return False
+
+
+class StartupTimer(object):
+    """
+    Wall time of each startup phase, from the moment the timer is created
+    (first thing in run.py) until ready(). Phases may overlap when they run
+    on different threads. Every phase is also exposed as a
+    startup_<phase>_seconds gauge.
+    """
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.phases = {}
+        self.ready_after = None
+
+    def phase(self, name):
+        """Context manager recording the time spent in the block as phase name"""
+        return _Phase(self, name)
+
+    def record(self, name, seconds):
+        self.phases[name] = seconds
+        REGISTRY.gauge(f"startup_{name}_seconds", f"Seconds spent in the {name} startup phase.",
+                       lambda: round(self.phases[name], 3))
+
+    def ready(self, status="Counting"):
+        """Marks the end of startup once, prints the phases and tells systemd we are up"""
+        if self.ready_after is not None:
+            return
+        self.ready_after = self.clock() - self.started
+        self.record("total", self.ready_after)
+        print("startup: " + self.summary())
+        notify("READY=1", f"STATUS={status}")
+
+    def summary(self):
+        return " | ".join("%s=%.2fs" % item for item in self.phases.items()) or "no phases"
+
+
+class _Phase(object):
+    __slots__ = ('timer', 'name', 'started')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = self.timer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.timer.record(self.name, self.timer.clock() - self.started)
+        return False
+
+
+# Created on the first import, which run.py does before anything else
+STARTUP = StartupTimer()
+
+
+class Watchdog(Thread):
+    """
+    Pings the systemd watchdog (WatchdogSec) at half its timeout for as long
+    as healthy() holds, so a stalled capture or inference gets the service
+    restarted. Does nothing when the unit has no watchdog.
+    """
+    def __init__(self, healthy, interval=None):
+        super().__init__(name="watchdog", daemon=True)
+        self.healthy = healthy
+        usec = os.environ.get("WATCHDOG_USEC")
+        self.timeout = int(usec) / 1e6 if usec else None
+        self.interval = interval or (self.timeout / 2 if self.timeout else None)
+        self.stop_event = Event()
+
+    def start(self):
+        if self.interval:
+            super().start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            if self.healthy():
+                notify("WATCHDOG=1")
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,218 @@
+"""
+pytest tests for the spool, the uploader and the fake camera capture path.
+Run from this directory with python -m pytest test_spool.py
+"""
+import gzip
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from capture import RGBCapture
+from fake_camera import FakeCamera
+from spool import DeliveryError, Spool, Uploader
+
+
+def sample(count, minute=0):
+    return {'img1': count, 'mode': count, 'timestamp': datetime(2024, 1, 1, 12, minute).isoformat()}
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    yield spool
+    spool.close()
+
+
+class StubServer(object):
+    """
+    Local HTTP server standing in for the Flask app. Records every POST body
+    and answers with the next status from statuses, 201 once they run out
+    """
+    def __init__(self, statuses=(), delay=0.0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like the real server behind the uploader's session
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                stub.requests.append((self.path, json.loads(body)))
+                time.sleep(stub.delay)
+                status = stub.statuses.pop(0) if stub.statuses else 201
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+def test_spool_is_fifo_and_peek_leaves_samples(spool):
+    ids = [spool.put(sample(count)) for count in range(5)]
+    assert ids == sorted(ids)
+    assert spool.peek(3) == [(id, sample(count)) for id, count in zip(ids[:3], range(3))]
+    assert len(spool) == 5
+
+
+def test_ack_removes_only_the_given_samples(spool):
+    ids = [spool.put(sample(count)) for count in range(4)]
+    spool.ack([ids[0], ids[2]])
+    spool.ack([])
+    assert [id for id, _ in spool.peek(10)] == [ids[1], ids[3]]
+
+
+def test_unacked_samples_survive_a_crash(tmp_path):
+    path = str(tmp_path / "spool.db")
+    spool = Spool(path)
+    ids = [spool.put(sample(count)) for count in range(3)]
+    spool.ack(ids[:1])
+    # No close, as if the process had been killed mid upload
+    recovered = Spool(path)
+    assert recovered.peek(10) == [(ids[1], sample(1)), (ids[2], sample(2))]
+    # Ids keep counting up, the server dedupes on them
+    assert recovered.put(sample(9)) > ids[-1]
+    recovered.close()
+    spool.close()
+
+
+def test_a_new_spool_file_starts_past_earlier_ids(tmp_path):
+    first = Spool(str(tmp_path / "first.db"))
+    old_id = first.put(sample(1))
+    first.close()
+    second = Spool(str(tmp_path / "second.db"))
+    assert second.put(sample(1)) > old_id
+    second.close()
+
+
+def test_batch_upload_sends_spool_ids_as_seq(spool, server):
+    ids = [spool.put(sample(count, minute=count)) for count in range(3)]
+    uploader = Uploader(spool, server.url + "/add/", batch_route=server.url + "/add/batch/",
+                        device_id="door")
+    assert uploader.drain_once() == 3
+    assert len(spool) == 0
+    path, body = server.requests[0]
+    assert path == "/add/batch/"
+    assert body["device"] == "door"
+    assert [entry["seq"] for entry in body["samples"]] == ids
+    assert [entry["number_ppl"] for entry in body["samples"]] == [0, 1, 2]
+    uploader.session.close()
+
+
+def test_partial_delivery_acks_only_what_arrived(spool, server):
+    server.statuses = [201, 201, 500]
+    ids = [spool.put(sample(count)) for count in range(4)]
+    uploader = Uploader(spool, server.url + "/add/")
+    with pytest.raises(DeliveryError) as raised:
+        uploader.drain_once()
+    assert raised.value.delivered == ids[:2]
+    assert uploader.delivered == 2
+    assert [id for id, _ in spool.peek(10)] == ids[2:]
+    # The rest goes out on the next attempt, nothing is sent twice
+    assert uploader.drain_once() == 2
+    assert len(spool) == 0
+    assert [body for _, body in server.requests] == [sample(count) for count in (0, 1, 2, 2, 3)]
+    uploader.session.close()
+
+
+def test_failures_back_off_exponentially_and_reset(spool, server):
+    server.statuses = [500, 503, 500, 500]
+    spool.put(sample(1))
+    uploader = Uploader(spool, server.url + "/add/", batch_route=server.url + "/add/batch/",
+                        min_backoff=1.0, max_backoff=4.0, idle_interval=30.0)
+    waits = []
+
+    def wait(timeout):
+        # Record the delay instead of sleeping, stop once the spool drained
+        waits.append(timeout)
+        if len(spool) == 0:
+            uploader.stop_event.set()
+        return uploader.stop_event.is_set()
+
+    uploader.stop_event.wait = wait
+    uploader.run()
+    assert uploader.failures == 4
+    assert uploader.delivered == 1
+    retries, idle = waits[:-1], waits[-1]
+    # Jittered by +-20% around 1, 2, 4 and then the 4s cap
+    for delay, expected in zip(retries, (1.0, 2.0, 4.0, 4.0)):
+        assert 0.8 * expected <= delay <= 1.2 * expected
+    assert idle == 30.0
+    assert uploader.backoff == 1.0
+    uploader.session.close()
+
+
+def test_stop_waits_for_the_batch_in_flight(spool, server):
+    server.delay = 0.3
+    for count in range(4):
+        spool.put(sample(count))
+    uploader = Uploader(spool, server.url + "/add/", batch_size=4, timeout=1.0)
+    assert uploader.longest_send == 4.0
+    uploader.start()
+    while not server.requests:
+        time.sleep(0.01)
+    uploader.stop(timeout=None)
+    # Every sample the server took was acked before the thread ended
+    assert not uploader.is_alive()
+    assert len(server.requests) == 4
+    assert len(spool) == 0
+
+
+def test_unknown_wire_format_is_rejected(spool):
+    with pytest.raises(ValueError):
+        Uploader(spool, "http://127.0.0.1:9/add/", session=object(), wire_format="xml")
+
+
+def test_fake_camera_rgb_capture_crops_the_padding():
+    frames = [np.random.randint(0, 255, (50, 100, 3), dtype=np.uint8) for _ in range(3)]
+    capture = RGBCapture(FakeCamera(frames=frames), 100, 50)
+    # Rows padded to 32 pixels and the height to 16
+    assert capture.buffer.shape == (64, 128, 3)
+    captured = [frame.copy() for frame in capture.capture_continuous()]
+    assert len(captured) == 3
+    for frame, expected in zip(captured, frames):
+        assert np.array_equal(frame, expected)
+
+
+def test_fake_camera_rgb_capture_resizes_and_runs_out():
+    frame = np.arange(40 * 60 * 3, dtype=np.uint8).reshape(40, 60, 3)
+    capture = RGBCapture(FakeCamera(frames=[frame]), 30, 20)
+    assert np.array_equal(capture.capture(), frame[::2, ::2])
+    with pytest.raises(EOFError):
+        capture.capture()
+
+
+def test_fake_camera_synthetic_frames_move():
+    capture = RGBCapture(FakeCamera(frame_limit=2), 64, 48)
+    first = capture.capture().copy()
+    second = capture.capture()
+    assert first.shape == (48, 64, 3)
+    assert not np.array_equal(first, second)
+    with pytest.raises(EOFError):
+        capture.capture()
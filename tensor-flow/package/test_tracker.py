@@ -0,0 +1,38 @@
+"""
+pytest tests for the tracker's reported counts.
+Run from this directory with python -m pytest test_tracker.py
+"""
+import numpy as np
+
+from detector import DETECTION_DTYPE
+from tracker import Tracker
+
+
+def detections(*boxes):
+    result = np.empty(len(boxes), dtype=DETECTION_DTYPE)
+    for i, box in enumerate(boxes):
+        result[i] = (box, 0, 0.9)
+    return result
+
+
+def test_update_counts_only_what_the_detector_saw():
+    tracker = Tracker()
+    assert len(tracker.update(detections([0.1, 0.1, 0.5, 0.3]))) == 1
+    # The person left: no detections means nobody is counted, even while
+    # the missed track is kept around
+    assert [len(tracker.update(detections())) for _ in range(6)] == [0] * 6
+
+
+def test_predict_carries_missed_tracks_between_detector_runs():
+    tracker = Tracker()
+    tracker.update(detections([0.1, 0.1, 0.5, 0.3]))
+    tracker.update(detections())
+    assert len(tracker.predict()) == 1
+
+
+def test_matched_tracks_keep_their_id():
+    tracker = Tracker()
+    first = tracker.update(detections([0.1, 0.1, 0.5, 0.3], [0.5, 0.6, 0.9, 0.8]))
+    second = tracker.update(detections([0.52, 0.61, 0.92, 0.81], [0.12, 0.11, 0.52, 0.31]))
+    assert sorted(first['track_id']) == sorted(second['track_id'])
+    assert len(second) == 2
@@ -0,0 +1,139 @@
+import numpy as np
+
+from boxes import iou_matrix, centers
+from detector import DETECTION_DTYPE
+
+# Detection records extended with the stable id of the track they belong to
+TRACK_DTYPE = np.dtype(DETECTION_DTYPE.descr + [('track_id', np.int32)])
+
+
+class Track(object):
+    """A single person followed across frames with a constant velocity model"""
+    __slots__ = ('track_id', 'box', 'velocity', 'score', 'class_id', 'confidence',
+                 'hits', 'misses', 'since_update', 'side')
+
+    def __init__(self, track_id, box, score, class_id):
+        self.track_id = track_id
+        self.box = np.array(box, dtype=np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.score = float(score)
+        self.class_id = int(class_id)
+        self.confidence = float(score)
+        self.hits = 1
+        self.misses = 0
+        self.since_update = 0
+        self.side = None
+
+    def predict(self, decay):
+        """Moves the box one frame along its velocity and decays the confidence"""
+        self.box += self.velocity
+        self.confidence *= decay
+        self.since_update += 1
+
+    def correct(self, box, score, smoothing):
+        """Snaps the track onto a matched detection and re-estimates its velocity"""
+        box = np.asarray(box, dtype=np.float32)
+        # The box was extrapolated for since_update frames, undo that to get
+        # the displacement per frame since the last real observation
+        observed_from = self.box - self.velocity * self.since_update
+        measured = (box - observed_from) / max(self.since_update, 1)
+        self.velocity = smoothing * measured + (1 - smoothing) * self.velocity
+        self.box = box
+        self.score = float(score)
+        self.confidence = float(score)
+        self.hits += 1
+        self.misses = 0
+        self.since_update = 0
+
+
+class Tracker(object):
+    """
+    Assigns stable ids to detections by greedy IoU matching against
+    constant velocity predictions, carrying boxes between detector runs.
+
+    line: optional ((y1, x1), (y2, x2)) counting line in relative
+    coordinates. A track centre crossing from the right to the left side
+    of the line, looking from the first point to the second in image
+    coordinates, counts as an entry and the opposite direction as an exit.
+    """
+    def __init__(self, iou_threshold=0.3, max_misses=5, decay=0.9, min_confidence=0.3,
+                 smoothing=0.5, line=None):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.decay = decay
+        self.min_confidence = min_confidence
+        self.smoothing = smoothing
+        self.line = None if line is None else np.asarray(line, dtype=np.float32)
+        self.tracks = []
+        self.next_id = 0
+        self.entries = 0
+        self.exits = 0
+
+    def predict(self):
+        """Advances every track one frame without a detection, returns the current tracks"""
+        for track in self.tracks:
+            track.predict(self.decay)
+        self._count_crossings()
+        return self.results()
+
+    def update(self, detections):
+        """
+        Matches a detect_objects result onto the tracks, returns the tracks
+        this result matched or started. Missed tracks are kept for
+        predict() to carry but are not reported, so the count is exactly
+        what the detector saw
+        """
+        for track in self.tracks:
+            track.predict(self.decay)
+        boxes = detections['bounding_box']
+        unmatched = set(range(len(detections)))
+        if self.tracks and len(detections):
+            iou = iou_matrix([track.box for track in self.tracks], boxes)
+            while True:
+                t, d = np.unravel_index(np.argmax(iou), iou.shape)
+                if iou[t, d] < self.iou_threshold:
+                    break
+                self.tracks[t].correct(boxes[d], detections['score'][d], self.smoothing)
+                unmatched.discard(d)
+                iou[t, :] = -1
+                iou[:, d] = -1
+        for track in self.tracks:
+            if track.since_update:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        for d in sorted(unmatched):
+            self.tracks.append(Track(self.next_id, boxes[d], detections['score'][d],
+                                     detections['class_id'][d]))
+            self.next_id += 1
+        self._count_crossings()
+        return self.results(updated_only=True)
+
+    def needs_detection(self):
+        """True once any track's confidence has decayed below min_confidence"""
+        return any(track.confidence < self.min_confidence for track in self.tracks)
+
+    def _count_crossings(self):
+        if self.line is None or not self.tracks:
+            return
+        start, end = self.line
+        points = centers([track.box for track in self.tracks])
+        direction = end - start
+        # Sign of the cross product tells which side of the line a centre is on
+        cross = direction[0] * (points[:, 1] - start[1]) - direction[1] * (points[:, 0] - start[0])
+        for track, side in zip(self.tracks, np.sign(cross).tolist()):
+            if side == 0:
+                continue
+            if track.side is not None and side != track.side:
+                if side > 0:
+                    self.entries += 1
+                else:
+                    self.exits += 1
+            track.side = side
+
+    def results(self, updated_only=False):
+        """Current tracks (only those matched by the last update when updated_only) as a TRACK_DTYPE array"""
+        tracks = [track for track in self.tracks if not updated_only or track.since_update == 0]
+        results = np.empty(len(tracks), dtype=TRACK_DTYPE)
+        for i, track in enumerate(tracks):
+            results[i] = (np.clip(track.box, 0, 1), track.class_id, track.confidence, track.track_id)
+        return results
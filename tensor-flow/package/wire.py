@@ -0,0 +1,114 @@
+"""
+Compact binary encoding of sample batches sent to the server's /add/batch/.
+
+A payload is one or more frames. Each frame is
+
+    header   <4sBBH   magic b'PCNT', version, device id length, record count
+    device   utf-8 device id
+    base     <qq      epoch seconds and sequence number of the first record
+    records  <HIh     per record: sequence delta from the previous record,
+                      seconds since the frame's base timestamp and count
+                      delta from the previous record (the first from 0)
+    trailer  <I       CRC32 of everything before it in the frame
+
+A sample is {'seq': int, 'ts': int, 'number_ppl': int}, the same shape the
+JSON batches use. Deltas that do not fit their field start a new frame.
+opencv/Model/wire.py decodes this on the server, keep the two in step and
+bump VERSION on any layout change.
+"""
+import struct
+import zlib
+
+MAGIC = b'PCNT'
+VERSION = 1
+CONTENT_TYPE = 'application/x-pcnt'
+
+HEADER = struct.Struct('<4sBBH')
+BASE = struct.Struct('<qq')
+RECORD = struct.Struct('<HIh')
+TRAILER = struct.Struct('<I')
+
+MAX_RECORDS = 0xFFFF
+
+
+class WireError(ValueError):
+    """Raised for payloads that are truncated, corrupt or of an unknown version"""
+
+
+def _fits(seq_delta, ts_delta, count_delta):
+    return 0 <= seq_delta <= 0xFFFF and 0 <= ts_delta <= 0xFFFFFFFF and -0x8000 <= count_delta <= 0x7FFF
+
+
+def _frame(device, records, base_ts, base_seq):
+    body = HEADER.pack(MAGIC, VERSION, len(device), len(records)) + device + BASE.pack(base_ts, base_seq)
+    body += b''.join(RECORD.pack(*record) for record in records)
+    return body + TRAILER.pack(zlib.crc32(body))
+
+
+def encode(device_id, samples):
+    """device_id:(str), samples:(list) of seq/ts/number_ppl dicts in seq order -> (bytes)"""
+    device = device_id.encode('utf-8')
+    if len(device) > 0xFF:
+        raise WireError("Device id longer than 255 bytes")
+    frames = []
+    records = []
+    base_ts = base_seq = previous_seq = previous_count = None
+    for sample in samples:
+        seq, ts, count = sample['seq'], sample['ts'], sample['number_ppl']
+        if records:
+            record = (seq - previous_seq, ts - base_ts, count - previous_count)
+        if not records or len(records) == MAX_RECORDS or not _fits(*record):
+            if records:
+                frames.append(_frame(device, records, base_ts, base_seq))
+            records = []
+            base_ts, base_seq = ts, seq
+            record = (0, 0, count)
+            if not _fits(*record):
+                raise WireError(f"Count {count} does not fit a record")
+        records.append(record)
+        previous_seq, previous_count = seq, count
+    if records:
+        frames.append(_frame(device, records, base_ts, base_seq))
+    return b''.join(frames)
+
+
+def decode(payload):
+    """(bytes) -> (device_id, samples) of every frame in the payload, frames must share a device"""
+    device_id = None
+    samples = []
+    offset = 0
+    view = memoryview(payload)
+    while offset < len(payload):
+        start = offset
+        try:
+            magic, version, device_length, count = HEADER.unpack_from(view, offset)
+        except struct.error:
+            raise WireError("Truncated frame header")
+        if magic != MAGIC:
+            raise WireError("Bad magic")
+        if version != VERSION:
+            raise WireError(f"Unsupported version {version}")
+        offset += HEADER.size
+        end = offset + device_length + BASE.size + count * RECORD.size
+        if end + TRAILER.size > len(payload):
+            raise WireError("Truncated frame")
+        (crc,) = TRAILER.unpack_from(view, end)
+        if zlib.crc32(view[start:end]) != crc:
+            raise WireError("Checksum mismatch")
+        try:
+            device = bytes(view[offset:offset + device_length]).decode('utf-8')
+        except UnicodeDecodeError:
+            raise WireError("Device id is not utf-8")
+        if device_id is not None and device != device_id:
+            raise WireError("Frames from different devices")
+        device_id = device
+        offset += device_length
+        base_ts, seq = BASE.unpack_from(view, offset)
+        offset += BASE.size
+        number_ppl = 0
+        for seq_delta, ts_delta, count_delta in RECORD.iter_unpack(view[offset:end]):
+            seq += seq_delta
+            number_ppl += count_delta
+            samples.append({'seq': seq, 'ts': base_ts + ts_delta, 'number_ppl': number_ppl})
+        offset = end + TRAILER.size
+    return device_id, samples
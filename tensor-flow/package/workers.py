@@ -0,0 +1,238 @@
+import multiprocessing
+import os
+from collections import defaultdict, namedtuple
+from multiprocessing.connection import wait
+from threading import Lock, Condition
+from time import monotonic
+
+from backends import load_backend
+
+PoolResult = namedtuple('PoolResult', ['source_id', 'seq', 'detections', 'meta', 'error'])
+
+
+def _worker_main(model, labels, threshold, backends, detector_options, roi, tasks, results):
+    """Worker process loop, owns one detector backend and runs frames until told to stop"""
+    try:
+        # Warmed up on load: the first invoke allocates and tunes the
+        # interpreter's buffers, pay for it before reporting ready rather
+        # than on the first live frame
+        detector = load_backend(backends, model=model, labels=labels, threshold=threshold,
+                                **detector_options)
+        if roi is not None:
+            from roi import RoiDetector
+            detector = RoiDetector(detector, roi)
+    except Exception as err:
+        results.send((None, None, repr(err)))
+        return
+    results.send((None, detector.capture_size, None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        number, frame = task
+        try:
+            results.send((number, detector.detect_objects(frame), None))
+        except Exception as err:
+            results.send((number, None, repr(err)))
+
+
+class InferencePool(object):
+    """
+    Process pool inference engine. Every worker process loads its own
+    detector, the first of backends (see backends.load_backend) that works,
+    with num_threads interpreter threads. Frames submitted from any number
+    of sources are handed to the least busy worker, and results come back
+    tagged with per-source sequence numbers, in submission order per source.
+    With a roi.RegionOfInterest every worker only looks at that region.
+    Submitting None instead of a frame files an empty result in its place,
+    for frames the caller chose not to run (e.g. a motion.MotionGate).
+
+    Every worker has its own task queue and result pipe, so the pool knows
+    which frames a worker holds and one dying cannot wedge a lock the
+    others share: its frames come back as error results and the frames
+    after them keep flowing. Startup raises RuntimeError when a
+    worker fails to load its model or is not ready within startup_timeout
+    seconds, get() and submit() raise once no worker is left.
+    """
+    def __init__(self, model, labels, threshold=0.4, workers=None, num_threads=1,
+                 max_pending=None, roi=None, backends=('tflite',), startup_timeout=120.0,
+                 **detector_options):
+        # spawn rather than fork so the workers never inherit the parent's threads
+        context = multiprocessing.get_context('spawn')
+        self.workers = workers or os.cpu_count() or 1
+        # Frames queued or running per worker
+        self.capacity = -(-(max_pending or self.workers * 2) // self.workers)
+        self.tasks = [context.Queue() for _ in range(self.workers)]
+        pipes = [context.Pipe(duplex=False) for _ in range(self.workers)]
+        self.results = [reader for reader, _ in pipes]
+        detector_options['num_threads'] = num_threads
+        self.processes = [
+            context.Process(target=_worker_main, name=f"inference-{i}", daemon=True,
+                            args=(model, labels, threshold, list(backends), detector_options, roi,
+                                  self.tasks[i], writer))
+            for i, (_, writer) in enumerate(pipes)
+        ]
+        for process in self.processes:
+            process.start()
+        # Only the workers hold the write ends, so a dead worker's pipe reads EOF
+        for _, writer in pipes:
+            writer.close()
+
+        self.lock = Lock()
+        self.freed = Condition(self.lock)
+        self.next_seq = defaultdict(int)
+        self.next_emit = defaultdict(int)
+        self.pending = defaultdict(dict)
+        self.meta = {}
+        # Task number -> (source_id, seq, worker index) of every frame handed out
+        self.in_flight = {}
+        self.assigned = [set() for _ in self.processes]
+        self.next_number = 0
+        self.dead = set()
+        self.dropped = 0
+        self.capture_size = None
+        try:
+            self._wait_ready(startup_timeout)
+        except Exception:
+            self.close(timeout=1.0)
+            raise
+
+    def _wait_ready(self, timeout):
+        """Blocks until every worker has loaded and warmed up its model"""
+        deadline = monotonic() + timeout
+        waiting = dict(zip(self.results, self.processes))
+        while waiting:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"Inference workers not ready after {timeout:g}s")
+            for reader in wait(list(waiting), remaining):
+                process = waiting.pop(reader)
+                try:
+                    _, capture_size, error = reader.recv()
+                except EOFError:
+                    process.join(1.0)
+                    raise RuntimeError(f"Inference worker {process.name} exited with code "
+                                       f"{process.exitcode} while loading the model")
+                if error is not None:
+                    raise RuntimeError(f"Inference worker {process.name} could not load the model: {error}")
+                self.capture_size = capture_size
+
+    def _least_busy(self):
+        """Index of the live worker with the fewest frames, None when all are full"""
+        live = [i for i in range(self.workers) if i not in self.dead]
+        if not live:
+            raise RuntimeError("Every inference worker has died")
+        index = min(live, key=lambda i: len(self.assigned[i]))
+        return index if len(self.assigned[index]) < self.capacity else None
+
+    def submit(self, source_id, frame, meta=None, block=True):
+        """
+        Queues a frame for inference, returns its sequence number within
+        source_id, or None when block is False and every worker is busy.
+        A frame of None comes back in order with detections None
+        """
+        with self.lock:
+            if frame is None:
+                seq = self.next_seq[source_id]
+                self.next_seq[source_id] = seq + 1
+                self.meta[(source_id, seq)] = meta
+                self.pending[source_id][seq] = (None, None)
+                return seq
+            index = self._least_busy()
+            while index is None:
+                if not block:
+                    self.dropped += 1
+                    return None
+                self.freed.wait(0.5)
+                index = self._least_busy()
+            seq = self.next_seq[source_id]
+            number = self.next_number
+            self.next_seq[source_id] = seq + 1
+            self.next_number = number + 1
+            self.meta[(source_id, seq)] = meta
+            self.in_flight[number] = (source_id, seq, index)
+            self.assigned[index].add(number)
+            self.tasks[index].put((number, frame))
+        return seq
+
+    def _ready(self):
+        """Pops the next in-order result of any source, or None"""
+        for source_id, pending in self.pending.items():
+            seq = self.next_emit[source_id]
+            if seq in pending:
+                detections, error = pending.pop(seq)
+                self.next_emit[source_id] = seq + 1
+                return PoolResult(source_id, seq, detections, self.meta.pop((source_id, seq), None), error)
+        return None
+
+    def _finish(self, number, detections, error):
+        """Files the result of task number, the caller holds the lock"""
+        if number not in self.in_flight:
+            return
+        source_id, seq, index = self.in_flight.pop(number)
+        self.assigned[index].discard(number)
+        self.pending[source_id][seq] = (detections, error)
+        self.freed.notify_all()
+
+    def get(self, timeout=None):
+        """Returns the next PoolResult in per-source order, or None on timeout"""
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.lock:
+            result = self._ready()
+        while result is None:
+            live = [reader for index, reader in enumerate(self.results) if index not in self.dead]
+            if not live:
+                raise RuntimeError("Every inference worker has died")
+            remaining = None if deadline is None else max(deadline - monotonic(), 0)
+            ready = wait(live, remaining)
+            if not ready:
+                return None
+            with self.lock:
+                for reader in ready:
+                    index = self.results.index(reader)
+                    try:
+                        number, detections, error = reader.recv()
+                    except (EOFError, OSError):
+                        self._reap(index)
+                        continue
+                    self._finish(number, detections, error)
+                result = self._ready()
+        return result
+
+    def _reap(self, index):
+        """Fails the frames held by a dead worker, the caller holds the lock"""
+        process = self.processes[index]
+        process.join(1.0)
+        self.dead.add(index)
+        print(f"Inference worker {process.name} died with code {process.exitcode}, "
+              f"failing its {len(self.assigned[index])} frame(s)")
+        for number in sorted(self.assigned[index]):
+            self._finish(number, None, f"worker {process.name} died")
+        self.freed.notify_all()
+
+    @property
+    def alive(self):
+        """Number of worker processes still running"""
+        return sum(1 for process in self.processes if process.exitcode is None)
+
+    @property
+    def outstanding(self):
+        """Frames submitted whose results have not been returned by get yet"""
+        return len(self.meta)
+
+    def close(self, timeout=5.0):
+        for process, tasks in zip(self.processes, self.tasks):
+            if process.exitcode is None:
+                tasks.put(None)
+        for process, tasks in zip(self.processes, self.tasks):
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+            # Frames left for a dead worker would otherwise hold up exit
+            tasks.cancel_join_thread()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()